@@ -1,57 +1,171 @@
+import os
+import sys
+import contextlib
 import datetime as dt
-from jinja2 import Environment, FileSystemLoader
 import re
-from metalsmythe.builder import Builder, load_json, copy_directory
+from metalsmythe.builder import Builder, load_json, copy_directory, remove_directory
 from metalsmythe.utils import format_date
+from metalsmythe.images import resize_images
+from metalsmythe.assets import fingerprint_assets, asset_url_filter
+from metalsmythe.cache import open_cache_store
+from metalsmythe.objects import ObjectStore, pack_directory
+from metalsmythe.progress import ProgressReporter
+from metalsmythe.pipeline import (Pipeline, Stage, markdown_stage, layouts_stage, srcset_stage,
+                                  postprocess_stage, write_stage)
 import argparse
 
-PREFIX = ""
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser()
-    parser.add_argument("--prefix", default="",
-                        help="Prefix for links beginning with '/'")
-    args = parser.parse_args()
-    PREFIX = args.prefix
-
-print(f"PREFIX = {PREFIX}")
+def create_jinja_env():
+    """Creates the Jinja2 environment (and filters) used to render our layouts.  (jinja2 is
+    imported here so that scripts which import build.py only pay for it when they render.)"""
+    from jinja2 import Environment, FileSystemLoader
+    jinja_env = Environment(
+        loader=FileSystemLoader("layouts"),
+        autoescape=True
+    )
 
-jinja_env = Environment(
-    loader=FileSystemLoader("layouts"),
-    autoescape=True
-)
+    jinja_env.filters["format"] = format
+    jinja_env.filters["format_date"] = format_date
+    jinja_env.filters["spaceToDash"] = lambda x: re.sub("\\s+", "-", x)
+    jinja_env.filters["condenseTitle"] = lambda x: re.sub("\\s+", "", x.lower())
+    jinja_env.filters["trimSlashes"] = lambda x: x.strip("/")
+    jinja_env.filters["UTCDate"] = lambda x: format_date(x, "%b %d, %Y")   # date.toUTCString("M d, yyyy");
+    jinja_env.filters["blogDate"] = lambda x: format_date(x, "%B %d, %Y")  # new Date(string).toLocaleString("en-US", { year: "numeric", month: "long", day: "numeric" });
+    # NOTE: demo site shows UTCDate as: Fri, 02 Jun 2023 23:10:36 GMT
+    jinja_env.filters["asset_url"] = lambda x: x  # replaced with the manifest lookup in build()
+    return jinja_env
 
 
-jinja_env.filters["format"] = format
-jinja_env.filters["format_date"] = format_date
-jinja_env.filters["spaceToDash"] = lambda x: re.sub("\\s+", "-", x)
-jinja_env.filters["condenseTitle"] = lambda x: re.sub("\\s+", "", x.lower())
-jinja_env.filters["trimSlashes"] = lambda x: x.strip("/")
-jinja_env.filters["UTCDate"] = lambda x: format_date(x, "%b %d, %Y")   # date.toUTCString("M d, yyyy");
-jinja_env.filters["blogDate"] = lambda x: format_date(x, "%B %d, %Y")  # new Date(string).toLocaleString("en-US", { year: "numeric", month: "long", day: "numeric" });
-# NOTE: demo site shows UTCDate as: Fri, 02 Jun 2023 23:10:36 GMT
+def get_build_time():
+    """Returns the time to show as the site's build time.  This is SOURCE_DATE_EPOCH if it is
+    set (see https://reproducible-builds.org/specs/source-date-epoch/), or else the time of
+    the last commit.  It only changes when the sources do, so rendered pages (which all show
+    it) can be reused from the build cache.  The current time is only used outside of git.
+    The time is in UTC, so builds on machines in other time zones produce the same pages."""
+    if os.environ.get("SOURCE_DATE_EPOCH"):
+        return dt.datetime.fromtimestamp(int(os.environ["SOURCE_DATE_EPOCH"]), tz=dt.timezone.utc)
+    import subprocess
+    try:
+        result = subprocess.run(["git", "log", "-1", "--format=%ct"],
+                                capture_output=True, text=True, check=True)
+        return dt.datetime.fromtimestamp(int(result.stdout.strip()), tz=dt.timezone.utc)
+    except (OSError, ValueError, subprocess.CalledProcessError):
+        return dt.datetime.now(dt.timezone.utc)
 
 
-metadata = {
-    "site": load_json("src/content/data/site.json"),
-    "nav": load_json("src/content/data/navigation.json"),
-    "stats": {
-        "build_time": dt.datetime.now()
+def create_metadata():
+    """Loads the global metadata available to all templates"""
+    return {
+        "site": load_json("src/content/data/site.json"),
+        "nav": load_json("src/content/data/navigation.json"),
+        "stats": {
+            "build_time": get_build_time()
+        }
     }
-}
 
 
-builder = Builder(metadata)
-builder.load_files("**/*.md", base_dir="src/content")
-builder.create_collection("blog", "blog/*.md", limit=10, sort_key=lambda x: x["date"], reverse=True)
-#builder.remove("blog.md")
-#print([file["path"] for file in builder.files])
-#builder.remove_spaces()
-builder.markdown_to_html()
-builder.apply_layouts(jinja_env, default_layout="simple.html")
+def create_collections(builder):
+    """Creates our collections (this is shared with render.py so previews match the build)"""
+    builder.create_collection("blog", "blog/*.md", limit=10, sort_key=lambda x: x["date"], reverse=True)
+
+
+# Build cache entries that haven't been used for this long (in seconds) are removed
+CACHE_MAX_AGE = 7 * 24 * 60 * 60
+
+
+def create_cache_store():
+    """Opens the build cache.  By default this is a local directory, but METALSMYTHE_CACHE can
+    point to a shared HTTP store (with METALSMYTHE_CACHE_TOKEN as a bearer token) so that CI
+    runners reuse each other's work."""
+    headers = {}
+    if os.environ.get("METALSMYTHE_CACHE_TOKEN"):
+        headers["Authorization"] = "Bearer " + os.environ["METALSMYTHE_CACHE_TOKEN"]
+    return open_cache_store(os.environ.get("METALSMYTHE_CACHE", ".cache/store"), headers=headers)
+
+
+def build(prefix="", objects=None, pack=None, progress=None):
+    """Builds the full site into the 'build' directory.  If 'objects' is a directory, output
+    files are deduplicated through an ObjectStore there (see metalsmythe.objects), and if
+    'pack' is given, the finished site is also packed into a single archive at that path.
+    Progress is reported to 'progress' (a ProgressReporter) if it is given."""
+    jinja_env = create_jinja_env()
+    metadata = create_metadata()
+    cache = create_cache_store()
+    if objects is not None:
+        objects = ObjectStore(objects)
+    step = progress.stage if progress is not None else lambda name: contextlib.nullcontext()
 
-if PREFIX != "":
-    builder.prefix_links(PREFIX)
+    with step("assets"):
+        # the sitemap and feeds are kept so that they are only rewritten when they change
+        remove_directory("build", keep=["sitemap*.xml", "feed.xml", "atom.xml", "robots.txt"])
+        copy_directory("src/assets", "build/assets", objects=objects)
+        manifest = fingerprint_assets("build/assets", url_base="/assets",
+                                      manifest_path="build/assets/manifest.json", objects=objects)
+        jinja_env.filters["asset_url"] = asset_url_filter(manifest)
+
+    images = resize_images("src/assets/images/blog-images", "build/assets/images/blog-images",
+                           url_base="/assets/images/blog-images", cache=cache, progress=progress,
+                           objects=objects)
+
+    builder = Builder(metadata)
+    pipeline = Pipeline(builder, cache=cache, workers=4, progress=progress)
+    pipeline.add(Stage("load", lambda b: b.load_files("**/*.md", base_dir="src/content")))
+    pipeline.add(Stage("collections", create_collections))
+    #pipeline.add(Stage("remove", lambda b: b.remove("blog.md")))
+    #pipeline.add(Stage("remove_spaces", lambda b: b.remove_spaces()))
+    pipeline.add(markdown_stage())
+    # (the manifest is part of the key since the "asset_url" filter depends on it)
+    pipeline.add(layouts_stage(jinja_env, default_layout="simple.html", template_dir="layouts",
+                               key=manifest))
+    # (styles.css caps images at 500px, except for "#full-width" ones in the 1024px container)
+    pipeline.add(srcset_stage(images, sizes={
+        "": "(max-width: 500px) 100vw, 500px",
+        "#full-width": "(max-width: 1024px) 100vw, 1024px",
+    }))
+    pipeline.add(postprocess_stage(prefix=prefix, manifest=manifest, minify=True))
+    pipeline.add(write_stage("build", objects=objects))
+
+    site_url = metadata["site"]["siteURL"].rstrip("/") + prefix
+    pipeline.add(Stage("sitemap", lambda b: b.write_sitemap("build", site_url)))
+    pipeline.add(Stage("feeds", lambda b: (
+        b.write_feed("build/feed.xml", "blog", metadata["site"]["title"], site_url,
+                     site_url + "/feed.xml", metadata["site"]["description"], title_key="blogTitle"),
+        b.write_feed("build/atom.xml", "blog", metadata["site"]["title"], site_url,
+                     site_url + "/atom.xml", metadata["site"]["description"], format="atom",
+                     title_key="blogTitle"),
+    )))
+    pipeline.add(Stage("robots", lambda b: b.write_robots("build", site_url)))
+    pipeline.run()
+
+    if pack is not None:
+        with step("pack"):
+            pack_directory("build", pack)
+
+    if cache is not None:
+        cache.prune(CACHE_MAX_AGE)
+    if objects is not None:
+        objects.prune()  # (objects replaced by this build's outputs)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--prefix", default="",
+                        help="Prefix for links beginning with '/'")
+    parser.add_argument("--objects", metavar="DIRECTORY",
+                        help="deduplicate output files through an object store in this directory "
+                             "(ex: .cache/objects)")
+    parser.add_argument("--pack", metavar="FILE",
+                        help="also pack the site into a single archive (see serve.py --pack)")
+    parser.add_argument("--events", metavar="FILE",
+                        help="write progress events to this file as JSON lines")
+    parser.add_argument("--quiet", action="store_true",
+                        help="don't display progress")
+    parser.add_argument("--stall-timeout", type=float, default=60.0,
+                        help="seconds without progress before the slowest file in flight is "
+                             "dumped (default: %(default)s)")
+    args = parser.parse_args()
 
-builder.write("build", clean=True)
-copy_directory("src/assets", "build/assets")
+    print(f"PREFIX = {args.prefix}")
+    with ProgressReporter(events=args.events, stream=None if args.quiet else sys.stderr,
+                          stall_timeout=args.stall_timeout) as progress:
+        build(args.prefix, objects=args.objects, pack=args.pack, progress=progress)
@@ -0,0 +1,71 @@
+# File: cache_server.py
+# Simple stand-in for a remote build cache (an HTTP server or object store that supports
+# GET and PUT).  Cache entries are stored as files in a local directory.  This is meant for
+# testing metalsmythe.cache.HTTPCacheStore locally, for example:
+#
+#  python cache_server.py 8001 -d .cache/server
+#  METALSMYTHE_CACHE=http://localhost:8001 python build.py
+#
+# Like serve.py, this should not be used for any kind of production work.
+
+import os
+import shutil
+import argparse
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from metalsmythe.cache import LocalCacheStore
+
+
+class CacheHTTPRequestHandler(BaseHTTPRequestHandler):
+    """Minimal GET/PUT server for a directory of cache entries.  This is a stand-in for a
+    real object store when testing HTTPCacheStore."""
+
+    directory = ".cache/server"
+
+    def _path(self):
+        key = self.path.strip("/")
+        if not key or not all(c in "0123456789abcdef" for c in key):
+            return None
+        return LocalCacheStore(self.directory).path(key)
+
+    def do_GET(self):
+        path = self._path()
+        if path is None or not os.path.isfile(path):
+            self.send_error(HTTPStatus.NOT_FOUND, "Cache entry not found")
+            return
+        with open(path, "rb") as fp:
+            self.send_response(HTTPStatus.OK)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(os.fstat(fp.fileno()).st_size))
+            self.end_headers()
+            shutil.copyfileobj(fp, self.wfile)
+
+    def do_PUT(self):
+        path = self._path()
+        if path is None:
+            self.send_error(HTTPStatus.BAD_REQUEST, "Invalid cache key")
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        LocalCacheStore(self.directory).put(self.path.strip("/"), self.rfile.read(length))
+        self.send_response(HTTPStatus.CREATED)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-b', '--bind', default="",
+                        help='bind to this address (default: all interfaces)')
+    parser.add_argument('-d', '--directory', default=".cache/server",
+                        help='store cache entries in this directory (default: %(default)s)')
+    parser.add_argument('port', default=8001, type=int, nargs='?',
+                        help='bind to this port (default: %(default)s)')
+    args = parser.parse_args()
+
+    CacheHTTPRequestHandler.directory = args.directory
+    with ThreadingHTTPServer((args.bind, args.port), CacheHTTPRequestHandler) as httpd:
+        print(f"Serving cache entries from '{args.directory}' on port {args.port} ...")
+        try:
+            httpd.serve_forever()
+        except KeyboardInterrupt:
+            print("\nKeyboard interrupt received, exiting.")
@@ -0,0 +1,78 @@
+# File: check_assets.py
+# Checks that every asset a built page links to exists in the build.  The 'href', 'src' and
+# 'srcset' URLs of <link>, <script>, <img> and <source> tags that begin with the prefix are
+# mapped to files in the build directory, so stale links (ex: to a fingerprinted style sheet
+# from a previous build) are caught.  Run it after a build, with the same prefix:
+#
+#  python build.py --prefix /metalsmythe
+#  python check_assets.py --prefix /metalsmythe
+#
+# The script exits with a non-zero status if any link is missing its file.
+
+import os
+import sys
+import glob
+import argparse
+from urllib.parse import urlsplit, unquote
+from html.parser import HTMLParser
+
+
+ASSET_TAGS = ["link", "script", "img", "source"]
+
+
+class AssetParser(HTMLParser):
+    """Collects the asset URLs of <link>, <script>, <img> and <source> tags"""
+
+    def __init__(self):
+        super().__init__()
+        self.urls = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag not in ASSET_TAGS:
+            return
+        for name, value in attrs:
+            if value is None:
+                continue
+            if name in ("href", "src"):
+                self.urls.append(value)
+            elif name == "srcset":
+                self.urls.extend(c.split()[0] for c in value.split(",") if c.strip())
+
+
+def page_assets(html):
+    parser = AssetParser()
+    parser.feed(html)
+    parser.close()
+    return parser.urls
+
+
+def asset_path(url, prefix, directory):
+    """Returns the path in 'directory' for a URL on the site, or None for other URLs"""
+    parts = urlsplit(url)
+    if parts.scheme or parts.netloc or not parts.path.startswith(prefix + "/"):
+        return None
+    return os.path.join(directory, unquote(parts.path[len(prefix) + 1:]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--prefix", default="",
+                        help="Prefix for links beginning with '/' (as given to build.py)")
+    parser.add_argument("-d", "--directory", default="build",
+                        help="build directory (default: %(default)s)")
+    args = parser.parse_args()
+
+    prefix = args.prefix.rstrip("/")
+    pages = sorted(glob.glob(os.path.join(args.directory, "**", "*.html"), recursive=True))
+    missing = 0
+    for page in pages:
+        with open(page, encoding="utf-8") as fp:
+            urls = page_assets(fp.read())
+        for url in urls:
+            path = asset_path(url, prefix, args.directory)
+            if path is not None and not os.path.isfile(path):
+                missing += 1
+                print(f"FAIL {os.path.relpath(page, args.directory)}: missing {url}")
+
+    print(f"{'OK  ' if not missing else 'FAIL'} {len(pages)} pages ({missing} missing assets)")
+    sys.exit(1 if missing else 0)
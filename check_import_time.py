@@ -0,0 +1,98 @@
+# File: check_import_time.py
+# Checks the startup cost of our common entry points using "python -X importtime".
+# Each entry point is imported in a fresh interpreter (a few times, keeping the fastest
+# run) and we check that:
+#
+#  1. none of the heavy dependencies listed in DEFERRED are imported up front (these
+#     should only be loaded when they are actually used), and
+#  2. the cumulative import time of the entry point is within its budget (in ms).
+#
+# The script can be run with:
+#
+#  python check_import_time.py [--runs N] [--scale X] [--strict]
+#
+# It exits with a non-zero status if an entry point imports a deferred module.  Import
+# times depend on the machine (and on how busy it is), so an entry point that is over its
+# budget is only reported as a warning, unless '--strict' is given.  '--scale' multiplies
+# the time budgets, which is handy on slow machines.
+
+import re
+import sys
+import argparse
+import subprocess
+
+
+# Heavy dependencies that should be imported lazily
+DEFERRED = ["bs4", "markdown", "frontmatter", "dotmap", "PIL", "yaml", "jinja2",
+            "urllib.request", "http.server", "multiprocessing", "subprocess"]
+
+# Entry point -> (statement to run, import time budget in ms, DEFERRED modules it may import).
+# The scripts are imported as modules (their work is behind "if __name__ == '__main__'"), so
+# this is the startup cost of running them.  The budgets leave room for slow machines (about
+# twice the usual times): with eager imports the metalsmythe modules took 140-180 ms and
+# build.py/render.py 75-100 ms.
+ENTRY_POINTS = {
+    "metalsmythe.builder": ("import metalsmythe.builder", 40, []),
+    "metalsmythe.pipeline": ("import metalsmythe.pipeline", 80, []),
+    "metalsmythe.preview": ("import metalsmythe.preview", 80, []),
+    "metalsmythe.cache": ("import metalsmythe.cache", 40, []),
+    "build.py": ("import build", 80, []),
+    "render.py": ("import render", 80, []),
+    # serving is what serve.py is for, so it needs http.server (and http.client, ssl, email)
+    # up front, which is most of its startup time
+    "serve.py": ("import serve", 150, ["http.server"]),
+}
+
+_LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def measure(statement, startup=set()):
+    """Runs 'statement' in a fresh interpreter with -X importtime.  Returns the total
+    import time (ms) and the set of modules that were imported.  Modules in 'startup'
+    (the ones the interpreter imports on its own, see measure("pass")) aren't counted."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", statement],
+                            capture_output=True, text=True, check=True)
+    total_us = 0
+    modules = set()
+    for line in result.stderr.splitlines():
+        match = _LINE.match(line)
+        if match is None:
+            continue
+        module = match.group(4)
+        modules.add(module)
+        # top-level imports only, since their cumulative time includes their children
+        if len(match.group(3)) == 1 and module not in startup:
+            total_us += int(match.group(2))
+    return total_us / 1000, modules
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5,
+                        help="number of runs per entry point (default: %(default)s)")
+    parser.add_argument("--scale", type=float, default=1.0,
+                        help="multiply the time budgets by this factor (default: %(default)s)")
+    parser.add_argument("--strict", action="store_true",
+                        help="fail (rather than warn) if an entry point is over its budget")
+    args = parser.parse_args()
+
+    startup = measure("pass")[1]
+
+    failed = False
+    for name, (statement, budget, allowed) in ENTRY_POINTS.items():
+        runs = [measure(statement, startup) for i in range(args.runs)]
+        elapsed = min(run[0] for run in runs)
+        modules = runs[0][1]
+        budget = budget * args.scale
+
+        eager = [module for module in DEFERRED if module in modules and module not in allowed]
+        slow = elapsed > budget
+        if eager or (slow and args.strict):
+            status = "FAIL"
+            failed = True
+        else:
+            status = "WARN" if slow else "OK  "
+        print(f"{status} {name:24} {elapsed:6.1f} ms (budget {budget:.0f} ms)"
+              + (f"  eagerly imports: {', '.join(eager)}" if eager else ""))
+
+    sys.exit(1 if failed else 0)
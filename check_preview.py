@@ -0,0 +1,66 @@
+# File: check_preview.py
+# Checks that single-page previews (see render.py) link to the same pages as the full
+# build.  Each page is rendered with the Previewer and the links in its <a> tags are
+# compared with the ones in the built page.  Run it after a build, with the same prefix:
+#
+#  python build.py --prefix /metalsmythe
+#  python check_preview.py --prefix /metalsmythe [page ...]
+#
+# Pages are relative to "src/content" (default: blog.md).  The script exits with a
+# non-zero status if any page's links differ.
+
+import os
+import sys
+import argparse
+from html.parser import HTMLParser
+from render import create_previewer
+
+
+class LinkParser(HTMLParser):
+    """Collects the 'href' of each <a> tag"""
+
+    def __init__(self):
+        super().__init__()
+        self.links = []
+
+    def handle_starttag(self, tag, attrs):
+        href = dict(attrs).get("href")
+        if tag == "a" and href is not None:
+            self.links.append(href)
+
+
+def page_links(html):
+    parser = LinkParser()
+    parser.feed(html)
+    parser.close()
+    return parser.links
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("pages", nargs="*", default=["blog.md"],
+                        help="content files to check (default: blog.md)")
+    parser.add_argument("--prefix", default="",
+                        help="Prefix for links beginning with '/' (as given to build.py)")
+    parser.add_argument("-d", "--directory", default="build",
+                        help="build directory (default: %(default)s)")
+    args = parser.parse_args()
+
+    previewer = create_previewer(args.prefix)
+    failed = False
+    for page in args.pages:
+        built_path = os.path.join(args.directory, os.path.splitext(page)[0] + ".html")
+        with open(built_path, encoding="utf-8") as fp:
+            expected = page_links(fp.read())
+        actual = page_links(previewer.render(page))
+
+        ok = actual == expected
+        failed = failed or not ok
+        print(f"{'OK  ' if ok else 'FAIL'} {page} ({len(actual)} links)")
+        if not ok:
+            for link in sorted(set(actual) - set(expected)):
+                print(f"       only in preview: {link}")
+            for link in sorted(set(expected) - set(actual)):
+                print(f"       only in build:   {link}")
+
+    sys.exit(1 if failed else 0)
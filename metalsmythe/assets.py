@@ -0,0 +1,78 @@
+import os
+import re
+import glob
+import json
+import shutil
+import hashlib
+
+
+# Number of hex digits of the content hash added to fingerprinted file names
+HASH_LENGTH = 10
+
+# Matches file names produced by fingerprint_assets() (ex: "styles.0123456789.css")
+FINGERPRINT_PATTERN = re.compile(r"\.[0-9a-f]{%d}\.[A-Za-z0-9]+$" % HASH_LENGTH)
+
+
+def is_fingerprinted(path):
+    """Returns True if the path looks like a fingerprinted asset.  Since the name changes
+    whenever the contents do, these files can be cached by clients forever."""
+    return FINGERPRINT_PATTERN.search(path) is not None
+
+
+def fingerprint_path(path, digest):
+    """Inserts the (shortened) content hash before the file extension:
+    "assets/styles.css" -> "assets/styles.0123456789.css"."""
+    base, ext = os.path.splitext(path)
+    return f"{base}.{digest[0:HASH_LENGTH]}{ext}"
+
+
+def fingerprint_assets(asset_dir, url_base, patterns=["**/*.css", "**/*.js"], manifest_path=None,
+                       objects=None):
+    """Copies each asset in 'asset_dir' that matches one of the glob 'patterns' to a
+    fingerprinted file name containing a hash of its contents (see fingerprint_path()).
+    The original files are left in place.  Returns a manifest dict that maps the original
+    URL of each asset (url_base + relative path) to its fingerprinted URL:
+
+        {"/assets/styles.css": "/assets/styles.0123456789.css"}
+
+    If 'manifest_path' is given, the manifest is also written there as JSON.  If an
+    ObjectStore (see metalsmythe.objects) is given, the fingerprinted files are linked from it
+    instead of being copied.
+    """
+    manifest = {}
+    for pattern in patterns:
+        for path in sorted(glob.glob(os.path.join(asset_dir, pattern), recursive=True)):
+            if not os.path.isfile(path) or is_fingerprinted(path):
+                continue
+
+            with open(path, "rb") as fp:
+                digest = hashlib.sha256(fp.read()).hexdigest()
+
+            dst_path = fingerprint_path(path, digest)
+            if objects is not None:
+                objects.materialize(objects.put_file(path), dst_path)
+            elif not os.path.exists(dst_path):
+                shutil.copyfile(path, dst_path)
+
+            rel_path = os.path.relpath(path, asset_dir).replace('\\', '/')
+            url = url_base.rstrip("/") + "/" + rel_path
+            manifest[url] = fingerprint_path(url, digest)
+
+    if manifest_path is not None:
+        with open(manifest_path, "w") as fp:
+            json.dump(manifest, fp, indent=2, sort_keys=True)
+
+    return manifest
+
+
+def asset_url_filter(manifest):
+    """Returns a Jinja filter that maps an asset URL to its fingerprinted URL.  URLs that
+    aren't in the manifest are returned unchanged.  Example:
+
+        jinja_env.filters["asset_url"] = asset_url_filter(manifest)
+
+        <link rel="stylesheet" href="{{ '/assets/styles.css' | asset_url }}">
+    """
+    def asset_url(url):
+        return manifest.get(url, url)
+    return asset_url
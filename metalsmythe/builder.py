@@ -1,12 +1,12 @@
 import os
 import shutil
-import frontmatter as _frontmatter
-import markdown
 import glob
 import json
-from dotmap import DotMap
 from .utils import GlobPattern
-from .html import prefix_links
+from .html import prefix_links, fingerprint_links, srcset_images
+
+# NOTE: Heavy dependencies (frontmatter, markdown, dotmap, bs4) are imported inside the
+#       functions that use them so that scripts only pay for what they actually use.
 
 
 def load_file(path, base_dir=None, frontmatter=True):
@@ -22,6 +22,7 @@ def load_file(path, base_dir=None, frontmatter=True):
 
     file = {}
     if frontmatter:
+        import frontmatter as _frontmatter
         with open(full_path) as fp:
             post = _frontmatter.load(fp)
             file.update({key: post[key] for key in post.keys()})
@@ -34,17 +35,43 @@ def load_file(path, base_dir=None, frontmatter=True):
     return file
 
 
-def remove_directory(directory):
+def remove_directory(directory, keep=[]):
     """Deletes the given directory (so we can cleanly create a new one with
-    the same name)"""
-    if os.path.exists(directory):
+    the same name).  Files matching one of the glob patterns in 'keep' (relative
+    to the directory) are left in place, along with the directories they are in.
+    This is useful for outputs that are only rewritten when they change (see
+    metalsmythe.feeds)."""
+    if not os.path.exists(directory):
+        return
+    if not keep:
         shutil.rmtree(directory)
+        return
+
+    keep = [GlobPattern(pattern) for pattern in keep]
+    for dir_path, dir_names, file_names in os.walk(directory, topdown=False):
+        for file_name in file_names:
+            path = os.path.join(dir_path, file_name)
+            rel_path = os.path.relpath(path, directory).replace('\\', '/')
+            if not any(pattern.is_match(rel_path) for pattern in keep):
+                os.remove(path)
+        if dir_path != directory and not os.listdir(dir_path):
+            os.rmdir(dir_path)
 
 
-def copy_directory(src_dir, dst_dir):
+def copy_directory(src_dir, dst_dir, objects=None):
     """Copies the directory and all of its children to the destination.  This is
-    useful for doing a simple copy of asset files (images, style sheets, etc.)"""
-    shutil.copytree(src_dir, dst_dir, dirs_exist_ok=True)
+    useful for doing a simple copy of asset files (images, style sheets, etc.)
+    If an ObjectStore (see metalsmythe.objects) is given, the files are added to it
+    and linked into the destination instead of being copied."""
+    if objects is None:
+        shutil.copytree(src_dir, dst_dir, dirs_exist_ok=True)
+        return
+
+    for dir_path, dir_names, file_names in os.walk(src_dir):
+        for file_name in file_names:
+            src_path = os.path.join(dir_path, file_name)
+            dst_path = os.path.join(dst_dir, os.path.relpath(src_path, src_dir))
+            objects.materialize(objects.put_file(src_path), dst_path)
 
 
 def load_json(path):
@@ -65,6 +92,8 @@ def prep_template_params(file: dict, metadata :dict, dotmap=True):
     params.update(file)
 
     if dotmap:
+        from dotmap import DotMap
+
         def convert(x):
             if isinstance(x, dict):
                 return DotMap(x)
@@ -76,6 +105,48 @@ def prep_template_params(file: dict, metadata :dict, dotmap=True):
     return params
 
 
+def write_file(file, output_dir, objects=None):
+    """Writes a single file object to the output directory using its 'path' as the
+    file name and its 'contents' as the content.  If an ObjectStore is given (see
+    metalsmythe.objects), the contents are stored there and the file is linked to it."""
+    rel_dir, file_name = os.path.split(file["path"])
+    full_dir = os.path.join(output_dir, rel_dir)
+    full_path = os.path.join(full_dir, file_name)
+
+    if objects is not None:
+        objects.materialize(objects.put(file["contents"].encode("utf-8")), full_path)
+        return
+
+    os.makedirs(full_dir, exist_ok=True)
+    with open(full_path, "w") as fp:
+        fp.write(file["contents"])
+
+
+def markdown_to_html(file, file_extensions=[".md", ".markdown"], markdown_extensions=["extra"]):
+    """Converts a single file's markdown content to HTML if its path ends with one of the
+    given extensions, replacing the extension with ".html".  See Builder.markdown_to_html()."""
+    path = file["path"]
+    for file_ext in file_extensions:
+        if path.endswith(file_ext):
+            import markdown
+            end_index = len(path) - len(file_ext)
+            file["path"] = path[0:end_index] + ".html"
+            file["contents"] = markdown.markdown(file["contents"], extensions=markdown_extensions)
+            break
+
+
+def apply_layout(file, jinja_env, metadata, default_layout=None, dotmap=True):
+    """Renders a single file with its Jinja2 template ('layout' property or default_layout).
+    Files without a layout are left alone.  See Builder.apply_layouts()."""
+    template_name = file.get("layout", default_layout)
+    if template_name is None:
+        return
+
+    template = jinja_env.get_template(template_name)
+    params = prep_template_params(file, metadata, dotmap=dotmap)
+    file["contents"] = template.render(**params)
+
+
 class Builder(object):
     """Object that can read input files, apply common transformations, and write the
     results to a directory.  All files are loaded into memory and can then be manipulated
@@ -124,10 +195,11 @@ class Builder(object):
         """Removes the file with the given path (if it exists)"""
         self.files = [file for file in self.files if file["path"] != path]
 
-    def write(self, output_dir, clean=False):
+    def write(self, output_dir, clean=False, objects=None):
         """Writes all files to the specified directory.  The current set of keys will be
         used as the file names.  Each item's 'content' value will be used as the content
-        of the file."""
+        of the file.  If 'objects' (an ObjectStore) is given, identical files are only
+        stored once and linked into the directory (see metalsmythe.objects)."""
         if clean:
             remove_directory(output_dir)
 
@@ -135,15 +207,7 @@ class Builder(object):
             os.makedirs(output_dir)
 
         for file in self.files:
-            path = file["path"]
-            rel_dir, file_name = os.path.split(path)
-            full_dir = os.path.join(output_dir, rel_dir)
-            if not os.path.exists(full_dir):
-                os.makedirs(full_dir)
-
-            full_path = os.path.join(full_dir, file_name)
-            with open(full_path, "w") as fp:
-                fp.write(file["contents"])
+            write_file(file, output_dir, objects)
 
     def remove_spaces(self, replace_with='-'):
         """Removes all spaces from path names, replacing them with the specified character"""
@@ -159,13 +223,7 @@ class Builder(object):
         """
 
         for file in self.files:
-            path = file["path"]
-            for file_ext in file_extensions:
-                if path.endswith(file_ext):
-                    end_index = len(path) - len(file_ext)
-                    file["path"] = path[0:end_index] + ".html"
-                    file["contents"] = markdown.markdown(file["contents"], extensions=markdown_extensions)
-                    break
+            markdown_to_html(file, file_extensions, markdown_extensions)
 
     def apply_layouts(self, jinja_env, default_layout=None, dotmap=True):
         """Applies Jinja2 templates to our content.  A Jinja2.Environment provides the
@@ -181,13 +239,7 @@ class Builder(object):
         """
 
         for file in self.files:
-            template_name = file.get("layout", default_layout)
-            if template_name is None:
-                continue
-
-            template = jinja_env.get_template(template_name)
-            params = prep_template_params(file, self.metadata, dotmap=dotmap)
-            file["contents"] = template.render(**params)
+            apply_layout(file, jinja_env, self.metadata, default_layout, dotmap)
 
     def get_files(self, pattern):
         """Returns a list of files whose 'path' matches the given glob pattern.  Example:
@@ -252,3 +304,90 @@ class Builder(object):
             for file_ext in file_extensions:
                 if path.endswith(file_ext):
                     file["contents"] = prefix_links(file["contents"], prefix, selectors)
+
+    def srcset_images(self, images, sizes="100vw", file_extensions=[".html", ".htm"]):
+        """Adds 'srcset' attributes (and WebP <picture> sources) to <img> tags that reference
+        images with derivatives.  'images' is the dict returned by metalsmythe.images.resize_images().
+        This should be called before prefix_links() since the image URLs are matched un-prefixed.
+        """
+        for file in self.files:
+            path = file["path"]
+            for file_ext in file_extensions:
+                if path.endswith(file_ext):
+                    file["contents"] = srcset_images(file["contents"], images, sizes)
+
+    def fingerprint_links(self, manifest,
+                          selectors=["a", "link", "script", "img", "video", "audio", "source"],
+                          file_extensions=[".html", ".htm"]):
+        """Rewrites links to fingerprinted assets using the manifest returned by
+        metalsmythe.assets.fingerprint_assets().  This should be called before prefix_links().
+        """
+        for file in self.files:
+            path = file["path"]
+            for file_ext in file_extensions:
+                if path.endswith(file_ext):
+                    file["contents"] = fingerprint_links(file["contents"], manifest, selectors)
+
+    def postprocess_html(self, prefix="", manifest=None, minify=True, inline_css=None,
+                         selectors=["a", "link", "script", "img", "video", "audio", "source"],
+                         file_extensions=[".html", ".htm"], cache=None, processes=1):
+        """Runs a single fused pass over each HTML file that rewrites fingerprinted links
+        (see fingerprint_links()), prefixes links (see prefix_links()), inlines small style
+        sheets, and minifies the markup.  This replaces separate calls to fingerprint_links()
+        and prefix_links().  See metalsmythe.postprocess.postprocess_html() for details.
+
+        @param cache If given (a CacheStore or a location for open_cache_store()), results are
+                     cached there by a hash of the input and options
+        @param processes Number of worker processes to use (None = one per CPU)
+        """
+        options = {
+            "prefix": prefix,
+            "manifest": manifest,
+            "selectors": list(selectors),
+            "minify": minify,
+            "inline_css": inline_css,
+        }
+
+        from .postprocess import postprocess_files
+
+        files = [file for file in self.files
+                 if any(file["path"].endswith(file_ext) for file_ext in file_extensions)]
+        results = postprocess_files([file["contents"] for file in files], options,
+                                    cache=cache, processes=processes)
+        for file, contents in zip(files, results):
+            file["contents"] = contents
+
+    def write_sitemap(self, output_dir, site_url, pattern="**/*.html", exclude=["404.html"],
+                      date_key="date", filename="sitemap.xml"):
+        """Streams a sitemap for the current files straight to 'output_dir' (see
+        metalsmythe.feeds.write_sitemap()).  Files matching 'pattern' are included unless they
+        match one of the 'exclude' patterns or set 'sitemap: false' in their front-matter.
+        Large sites are split into a sitemap index and shards of up to 50,000 URLs each.
+        """
+        from .feeds import write_sitemap, sitemap_entries
+        entries = sitemap_entries(self.files, pattern, exclude, date_key)
+        return write_sitemap(entries, output_dir, site_url, filename=filename)
+
+    def write_feed(self, path, collection, title, site_url, feed_url, description="", format="rss",
+                   title_key="title", date_key="date", description_key="excerpt"):
+        """Streams an RSS (format="rss") or Atom (format="atom") feed for the files in the named
+        collection (see create_collection()) to 'path'.  The entry titles, dates, and descriptions
+        are read from the files' front-matter using the given keys.  Example:
+
+           write_feed("build/feed.xml", "blog", "My Blog", site_url, site_url + "/feed.xml",
+                      title_key="blogTitle")
+
+        """
+        from .feeds import write_feed
+        entries = ({
+            "path": file["path"],
+            "title": file.get(title_key),
+            "date": file.get(date_key),
+            "description": file.get(description_key),
+        } for file in self.metadata["collections"][collection])
+        write_feed(entries, path, title, site_url, feed_url, description, format)
+
+    def write_robots(self, output_dir, site_url, sitemap="sitemap.xml", disallow=[]):
+        """Writes a robots.txt file pointing to the sitemap (see metalsmythe.feeds.write_robots())"""
+        from .feeds import write_robots
+        write_robots(output_dir, site_url, sitemap, disallow)
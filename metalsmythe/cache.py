@@ -0,0 +1,233 @@
+import os
+import json
+import time
+import hashlib
+import warnings
+
+# NOTE: urllib.request is imported by HTTPCacheStore when it is used since it pulls in
+#       http.client, email, ssl, etc.
+
+
+def hash_value(obj):
+    """Returns a deterministic SHA-256 hex digest for a (JSON-like) value.  Dict keys are
+    sorted, and file objects that have already been visited (ex: the 'previous' and 'next'
+    links added by Builder.create_collection()) are hashed by their 'path' so that cyclic
+    references don't recurse forever.  Other objects (dates, etc.) are hashed via str().
+    Since nothing machine-specific goes into the hash, the same inputs produce the same
+    key on every machine.
+    """
+    digest = hashlib.sha256()
+    _hash_update(digest, obj, set())
+    return digest.hexdigest()
+
+
+def _hash_update(digest, obj, seen):
+    if isinstance(obj, dict):
+        if id(obj) in seen:
+            digest.update(b"<ref:" + str(obj.get("path")).encode("utf-8") + b">")
+            return
+        seen.add(id(obj))
+        digest.update(b"{")
+        for key in sorted(obj.keys(), key=str):
+            digest.update(str(key).encode("utf-8") + b":")
+            _hash_update(digest, obj[key], seen)
+        digest.update(b"}")
+    elif isinstance(obj, (list, tuple)):
+        digest.update(b"[")
+        for item in obj:
+            _hash_update(digest, item, seen)
+        digest.update(b"]")
+    elif obj is None or isinstance(obj, (bool, int, float)):
+        digest.update(repr(obj).encode("utf-8") + b",")
+    elif isinstance(obj, bytes):
+        digest.update(b"<bytes:" + hashlib.sha256(obj).digest() + b">")
+    else:
+        digest.update(json.dumps(str(obj)).encode("utf-8") + b",")
+
+
+def cache_key(namespace, *parts):
+    """Returns the cache key for an entry.  The namespace (ex: "markdown") keeps entries for
+    different kinds of data apart in a shared store."""
+    return hash_value([namespace, list(parts)])
+
+
+class CacheStore(object):
+    """Interface for content-addressed caches.  Keys are hex strings (see cache_key()) and
+    values are bytes.  Implementations must be safe to use from several threads and
+    processes at once (and so must be picklable)."""
+
+    def get(self, key):
+        """Returns the bytes stored for 'key', or None if there aren't any"""
+        raise NotImplementedError()
+
+    def put(self, key, data):
+        """Stores 'data' (bytes) under 'key'"""
+        raise NotImplementedError()
+
+    def prune(self, max_age):
+        """Removes entries that haven't been used for 'max_age' seconds and returns the number
+        removed.  Stores that can't track use (ex: remote stores, which should use the
+        server's own expiry rules) don't remove anything."""
+        return 0
+
+    def get_json(self, key):
+        data = self.get(key)
+        return None if data is None else json.loads(data.decode("utf-8"))
+
+    def put_json(self, key, value):
+        """Stores a JSON value.  Values that can't be serialized are silently not cached."""
+        try:
+            data = json.dumps(value, sort_keys=True).encode("utf-8")
+        except (TypeError, ValueError):
+            return
+        self.put(key, data)
+
+    def get_text(self, key):
+        data = self.get(key)
+        return None if data is None else data.decode("utf-8")
+
+    def put_text(self, key, text):
+        self.put(key, text.encode("utf-8"))
+
+
+class LocalCacheStore(CacheStore):
+    """Stores cache entries as files in a local directory ("<directory>/<key[0:2]>/<key>").
+    Entries are written to a temporary file and then moved into place so that concurrent
+    builds never read partial entries.  Reading an entry updates its modification time, so
+    prune() can remove the entries that are no longer used."""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, key):
+        return os.path.join(self.directory, key[0:2], key)
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            with open(path, "rb") as fp:
+                data = fp.read()
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return data
+
+    def put(self, key, data):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{id(data)}.tmp"
+        with open(tmp_path, "wb") as fp:
+            fp.write(data)
+        os.replace(tmp_path, path)
+
+    def prune(self, max_age):
+        cutoff = time.time() - max_age
+        removed = 0
+        for dir_path, dir_names, file_names in os.walk(self.directory):
+            for file_name in file_names:
+                path = os.path.join(dir_path, file_name)
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        os.remove(path)
+                        removed += 1
+                except FileNotFoundError:
+                    pass
+        return removed
+
+
+class HTTPCacheStore(CacheStore):
+    """Stores cache entries on an HTTP server or object store that supports GET and PUT
+    (ex: a bucket behind a signed base URL, or cache_server.py for local testing).  An entry
+    lives at "<base_url>/<key>".  Network errors are reported as warnings and treated as cache
+    misses so that an unavailable cache never breaks a build.  If the server can't be reached
+    at all, the store is disabled for the rest of the build.
+
+    @param base_url URL that keys are appended to
+    @param headers Extra headers to send with each request (ex: {"Authorization": "Bearer ..."})
+    @param read_only If True, entries are never uploaded (ex: for untrusted branch builds)
+    """
+
+    def __init__(self, base_url, headers={}, timeout=10, read_only=False):
+        self.base_url = base_url.rstrip("/")
+        self.headers = dict(headers)
+        self.timeout = timeout
+        self.read_only = read_only
+        self.available = True
+
+    def _unavailable(self, e):
+        warnings.warn(f"Cache server {self.base_url} is unavailable, disabling it: {e}")
+        self.available = False
+
+    def get(self, key):
+        if not self.available:
+            return None
+        import urllib.request
+        import urllib.error
+        request = urllib.request.Request(f"{self.base_url}/{key}", headers=self.headers)
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return response.read()
+        except urllib.error.HTTPError as e:
+            if e.code != 404:
+                warnings.warn(f"Cache GET failed for {key}: {e}")
+        except OSError as e:
+            self._unavailable(e)
+        return None
+
+    def put(self, key, data):
+        if self.read_only or not self.available:
+            return
+        import urllib.request
+        import urllib.error
+        headers = dict(self.headers)
+        headers["Content-Type"] = "application/octet-stream"
+        request = urllib.request.Request(f"{self.base_url}/{key}", data=data,
+                                         headers=headers, method="PUT")
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout):
+                pass
+        except urllib.error.HTTPError as e:
+            warnings.warn(f"Cache PUT failed for {key}: {e}")
+        except OSError as e:
+            self._unavailable(e)
+
+
+class TieredCacheStore(CacheStore):
+    """Checks a list of stores in order (ex: a local directory and then a remote store).
+    Entries found in a later store are copied into the earlier ones, and new entries are
+    written to all of them."""
+
+    def __init__(self, stores):
+        self.stores = list(stores)
+
+    def get(self, key):
+        for i, store in enumerate(self.stores):
+            data = store.get(key)
+            if data is not None:
+                for earlier in self.stores[0:i]:
+                    earlier.put(key, data)
+                return data
+        return None
+
+    def put(self, key, data):
+        for store in self.stores:
+            store.put(key, data)
+
+    def prune(self, max_age):
+        return sum(store.prune(max_age) for store in self.stores)
+
+
+def open_cache_store(location, local_dir=".cache/store", headers={}, read_only=False):
+    """Returns a CacheStore for the given location.  HTTP(S) URLs return an HTTPCacheStore
+    backed by a LocalCacheStore in 'local_dir' (so each entry is downloaded at most once per
+    machine).  Anything else is treated as a local directory.  If 'location' is a CacheStore
+    it is returned as-is, and None returns None (no caching)."""
+    if location is None or isinstance(location, CacheStore):
+        return location
+    if location.startswith("http://") or location.startswith("https://"):
+        remote = HTTPCacheStore(location, headers=headers, read_only=read_only)
+        return TieredCacheStore([LocalCacheStore(local_dir), remote])
+    return LocalCacheStore(location)
@@ -0,0 +1,224 @@
+import os
+import re
+import filecmp
+import datetime
+from email.utils import format_datetime
+from xml.sax.saxutils import escape, quoteattr
+from .utils import string_to_date, GlobPattern
+
+
+# Maximum number of URLs allowed in a single sitemap file (see sitemaps.org)
+SITEMAP_MAX_URLS = 50000
+
+
+class _ChangedFileWriter(object):
+    """Context manager that streams output to a temporary file and only replaces the target
+    file if the new contents are different.  This keeps the target's modification time (and
+    anything keyed on it, such as deploys and HTTP caches) unchanged when nothing changed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.tmp_path = f"{path}.{os.getpid()}.tmp"
+        self.changed = False
+
+    def __enter__(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self.fp = open(self.tmp_path, "w", encoding="utf-8")
+        return self.fp
+
+    def __exit__(self, exc_type, exc, tb):
+        self.fp.close()
+        if exc_type is not None:
+            os.remove(self.tmp_path)
+            return False
+
+        if os.path.exists(self.path) and filecmp.cmp(self.tmp_path, self.path, shallow=False):
+            os.remove(self.tmp_path)
+        else:
+            os.replace(self.tmp_path, self.path)
+            self.changed = True
+        return False
+
+
+def page_url(site_url, path):
+    """Returns the absolute URL for a file path ("blog/index.html" -> "<site_url>/blog/")"""
+    if path == "index.html" or path.endswith("/index.html"):
+        path = path[0:-len("index.html")]
+    return site_url.rstrip("/") + "/" + path
+
+
+def _to_datetime(value):
+    # front-matter dates may be strings, dates, or datetimes.  Naive values are assumed to be UTC.
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = string_to_date(value)
+    if not isinstance(value, datetime.datetime):
+        value = datetime.datetime(value.year, value.month, value.day)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=datetime.timezone.utc)
+    return value
+
+
+def _w3c_date(value):
+    value = _to_datetime(value)
+    return None if value is None else value.isoformat().replace("+00:00", "Z")
+
+
+def write_sitemap(entries, output_dir, site_url, filename="sitemap.xml", max_urls=SITEMAP_MAX_URLS):
+    """Streams a sitemap to 'output_dir'.  'entries' is an iterable of (path, lastmod) tuples
+    where 'lastmod' may be None.  If there are more than 'max_urls' entries, they are split
+    into shards ("sitemap-1.xml", "sitemap-2.xml", ...) and 'filename' becomes a sitemap index
+    that points to them.  Files are only rewritten if their contents change.  Returns the list
+    of file names that were written.
+    """
+    base, ext = os.path.splitext(filename)
+    shards = []
+    writer = None
+    fp = None
+    count = 0
+
+    def _close():
+        fp.write("</urlset>\n")
+        writer.__exit__(None, None, None)
+
+    # entries are streamed into shard files.  If everything fits in one shard, it is renamed
+    # to 'filename' at the end rather than building the whole sitemap in memory first.
+    for path, lastmod in entries:
+        if fp is None or count == max_urls:
+            if fp is not None:
+                _close()
+            shards.append(f"{base}-{len(shards) + 1}{ext}")
+            writer = _ChangedFileWriter(os.path.join(output_dir, shards[-1]))
+            fp = writer.__enter__()
+            fp.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+            fp.write('<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n')
+            count = 0
+
+        fp.write(f"<url><loc>{escape(page_url(site_url, path))}</loc>")
+        lastmod = _w3c_date(lastmod)
+        if lastmod is not None:
+            fp.write(f"<lastmod>{lastmod}</lastmod>")
+        fp.write("</url>\n")
+        count += 1
+
+    if fp is not None:
+        _close()
+
+    if len(shards) <= 1:
+        path = os.path.join(output_dir, filename)
+        if shards:
+            shard_path = os.path.join(output_dir, shards[0])
+            if os.path.exists(path) and filecmp.cmp(shard_path, path, shallow=False):
+                os.remove(shard_path)
+            else:
+                os.replace(shard_path, path)
+        else:
+            with _ChangedFileWriter(path) as fp:
+                fp.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+                fp.write('<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n</urlset>\n')
+        _remove_stale_shards(output_dir, filename, [])
+        return [filename]
+
+    with _ChangedFileWriter(os.path.join(output_dir, filename)) as fp:
+        fp.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        fp.write('<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n')
+        for shard in shards:
+            fp.write(f"<sitemap><loc>{escape(page_url(site_url, shard))}</loc></sitemap>\n")
+        fp.write("</sitemapindex>\n")
+    _remove_stale_shards(output_dir, filename, shards)
+    return [filename] + shards
+
+
+def _remove_stale_shards(output_dir, filename, shards):
+    # removes shards left over from earlier builds that had more URLs
+    base, ext = os.path.splitext(filename)
+    pattern = re.compile(re.escape(base) + r"-\d+" + re.escape(ext))
+    for file_name in os.listdir(output_dir):
+        if pattern.fullmatch(file_name) and file_name not in shards:
+            os.remove(os.path.join(output_dir, file_name))
+
+
+def write_feed(entries, path, title, site_url, feed_url, description="", format="rss"):
+    """Streams an RSS 2.0 (format="rss") or Atom (format="atom") feed to 'path'.  'entries' is
+    an iterable of dicts with the keys "path", "title", "date" and (optionally) "description".
+    The file is only rewritten if its contents change.
+    """
+    entries = list(entries)
+    dates = [_to_datetime(entry.get("date")) for entry in entries]
+    dates = [date for date in dates if date is not None]
+    updated = max(dates) if dates else datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+    with _ChangedFileWriter(path) as fp:
+        fp.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        if format == "atom":
+            fp.write('<feed xmlns="http://www.w3.org/2005/Atom">\n')
+            fp.write(f"<title>{escape(title)}</title>\n")
+            if description:
+                fp.write(f"<subtitle>{escape(description)}</subtitle>\n")
+            fp.write(f"<link href={quoteattr(site_url)}/>\n")
+            fp.write(f"<link rel=\"self\" href={quoteattr(feed_url)}/>\n")
+            fp.write(f"<id>{escape(feed_url)}</id>\n")
+            fp.write(f"<updated>{_w3c_date(updated)}</updated>\n")
+            for entry in entries:
+                url = page_url(site_url, entry["path"])
+                fp.write("<entry>")
+                fp.write(f"<title>{escape(str(entry.get('title') or ''))}</title>")
+                fp.write(f"<link href={quoteattr(url)}/>")
+                fp.write(f"<id>{escape(url)}</id>")
+                fp.write(f"<updated>{_w3c_date(entry.get('date') or updated)}</updated>")
+                if entry.get("description"):
+                    fp.write(f"<summary>{escape(str(entry['description']))}</summary>")
+                fp.write("</entry>\n")
+            fp.write("</feed>\n")
+        elif format == "rss":
+            fp.write('<rss version="2.0" xmlns:atom="http://www.w3.org/2005/Atom">\n<channel>\n')
+            fp.write(f"<title>{escape(title)}</title>\n")
+            fp.write(f"<link>{escape(site_url)}</link>\n")
+            fp.write(f"<description>{escape(description)}</description>\n")
+            fp.write(f"<atom:link href={quoteattr(feed_url)} rel=\"self\" type=\"application/rss+xml\"/>\n")
+            fp.write(f"<lastBuildDate>{format_datetime(updated)}</lastBuildDate>\n")
+            for entry in entries:
+                url = page_url(site_url, entry["path"])
+                fp.write("<item>")
+                fp.write(f"<title>{escape(str(entry.get('title') or ''))}</title>")
+                fp.write(f"<link>{escape(url)}</link>")
+                fp.write(f"<guid>{escape(url)}</guid>")
+                date = _to_datetime(entry.get("date"))
+                if date is not None:
+                    fp.write(f"<pubDate>{format_datetime(date)}</pubDate>")
+                if entry.get("description"):
+                    fp.write(f"<description>{escape(str(entry['description']))}</description>")
+                fp.write("</item>\n")
+            fp.write("</channel>\n</rss>\n")
+        else:
+            raise ValueError(f"Unknown feed format: '{format}'")
+
+
+def write_robots(output_dir, site_url, sitemap="sitemap.xml", disallow=[]):
+    """Writes a robots.txt file that allows all crawlers (except for the 'disallow' paths)
+    and points them to the sitemap.  The file is only rewritten if its contents change."""
+    with _ChangedFileWriter(os.path.join(output_dir, "robots.txt")) as fp:
+        fp.write("User-agent: *\n")
+        for path in disallow:
+            fp.write(f"Disallow: {path}\n")
+        if not disallow:
+            fp.write("Allow: /\n")
+        if sitemap is not None:
+            fp.write(f"\nSitemap: {page_url(site_url, sitemap)}\n")
+
+
+def sitemap_entries(files, pattern="**/*.html", exclude=["404.html"], date_key="date"):
+    """Yields (path, lastmod) tuples for the files that belong in a sitemap: files matching
+    'pattern' that don't match one of the 'exclude' patterns and don't set 'sitemap: false'
+    in their front-matter."""
+    include = GlobPattern(pattern)
+    exclude = [GlobPattern(p) for p in exclude]
+    for file in files:
+        path = file["path"]
+        if not include.is_match(path) or any(p.is_match(path) for p in exclude):
+            continue
+        if file.get("sitemap", True) is False:
+            continue
+        yield path, file.get(date_key)
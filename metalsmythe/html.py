@@ -1,4 +1,54 @@
-from bs4 import BeautifulSoup
+# NOTE: bs4 is imported inside the functions that use it so that importing metalsmythe
+#       doesn't pay for it unless HTML actually has to be parsed.
+
+
+# Attributes that hold links for each of the elements we know how to rewrite
+LINK_ATTRS = {
+    "a": ["href"],
+    "link": ["href"],
+    "script": ["src"],
+    "img": ["src", "srcset"],
+    "video": ["src"],
+    "audio": ["src"],
+    "source": ["src", "srcset"],
+}
+
+
+def link_attrs(soup, selectors, attrs=None):
+    """Yields (element, attribute name) for each link attribute (see LINK_ATTRS) of the
+    elements in 'selectors' that is present.  'attrs' can limit which attributes are
+    walked (ex: ["src"])."""
+    for elem_name in selectors:
+        for attr_name in LINK_ATTRS.get(elem_name, []):
+            if attrs is not None and attr_name not in attrs:
+                continue
+            for elem in soup.find_all(elem_name):
+                if elem.has_attr(attr_name):
+                    yield elem, attr_name
+
+
+def rewrite_attrs(soup, selectors, func):
+    """Walks the link attributes (see link_attrs()) of all elements in 'selectors' and
+    replaces each value with func(value).  'srcset' attributes are split into their
+    individual candidates so that func() only ever sees a single URL.
+    """
+    for elem, attr_name in link_attrs(soup, selectors):
+        if attr_name == "srcset":
+            elem[attr_name] = _rewrite_srcset(elem[attr_name], func)
+        else:
+            elem[attr_name] = func(elem[attr_name])
+
+
+def _rewrite_srcset(srcset, func):
+    """Applies func() to each URL in a 'srcset' value ("url 480w, url 960w")"""
+    candidates = []
+    for candidate in srcset.split(","):
+        parts = candidate.strip().split(None, 1)
+        if not parts:
+            continue
+        parts[0] = func(parts[0])
+        candidates.append(" ".join(parts))
+    return ", ".join(candidates)
 
 
 def prefix_links(html, prefix, selectors=["a", "link", "script", "img", "video", "audio", "source"]):
@@ -17,26 +67,71 @@ def prefix_links(html, prefix, selectors=["a", "link", "script", "img", "video",
     def _prefix(url):
         return prefix + url if url.startswith('/') else url
 
-    def _prefix_attrs(elem_name, attr_name):
-        for elem in soup.findAll(elem_name):
-            if elem.has_attr(attr_name):
-                elem[attr_name] = _prefix(elem[attr_name])
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html, features="html.parser")
+    rewrite_attrs(soup, selectors, _prefix)
+    return str(soup)
+
 
+def fingerprint_links(html, manifest, selectors=["a", "link", "script", "img", "video", "audio", "source"]):
+    """Rewrites links to assets that have been fingerprinted, replacing each URL that appears in
+    'manifest' (the dict returned by metalsmythe.assets.fingerprint_assets()) with its
+    fingerprinted URL.  Links are matched before prefixing, so call this before prefix_links().
+    """
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html, features="html.parser")
+    rewrite_attrs(soup, selectors, lambda url: manifest.get(url, url))
+    return str(soup)
+
+
+def srcset_images(html, images, sizes="100vw"):
+    """Adds 'srcset' attributes to <img> tags whose 'src' has derivatives in 'images' (the dict
+    returned by metalsmythe.images.resize_images()).  If WebP derivatives exist, the <img> is
+    wrapped in a <picture> element with a WebP <source> so that browsers which support it can
+    pick the smaller file.  The original 'src' is left in place as a fallback.
+
+    'sizes' should describe how wide the images are shown (ex: "(max-width: 500px) 100vw,
+    500px" if CSS caps them at 500px) so that browsers don't download larger files than they
+    need.  It can also be a dict mapping the query/fragment of an image's URL to the value to
+    use for it ("" for images without one), ex: {"": "500px", "#full-width": "100vw"}.
+    <img> tags that already have a 'sizes' attribute keep it.
+    """
+    from bs4 import BeautifulSoup
     soup = BeautifulSoup(html, features="html.parser")
 
-    if "a" in selectors:
-        _prefix_attrs("a", "href")
-    if "link" in selectors:
-        _prefix_attrs("link", "href")
-    if "script" in selectors:
-        _prefix_attrs("script", "src")
-    if "img" in selectors:
-        _prefix_attrs("img", "src")
-    if "video" in selectors:
-        _prefix_attrs("video", "src")
-    if "audio" in selectors:
-        _prefix_attrs("audio", "src")
-    if "source" in selectors:
-        _prefix_attrs("source", "src")
+    for img, attr_name in list(link_attrs(soup, ["img"], attrs=["src"])):
+        # images are looked up without any query or fragment (ex: "photo.jpg#full-width"),
+        # which is then kept on each of the derivatives' URLs
+        url, suffix = _split_suffix(img["src"])
+        image = images.get(url)
+        if image is None or img.has_attr("srcset"):
+            continue
+
+        img["srcset"] = _format_srcset(image["variants"][image["type"]], suffix)
+        if not img.has_attr("sizes"):
+            img["sizes"] = sizes if isinstance(sizes, str) else sizes.get(suffix, sizes[""])
+
+        webp = image["variants"].get("image/webp")
+        if webp and img.parent is not None and img.parent.name != "picture":
+            picture = soup.new_tag("picture")
+            source = soup.new_tag("source", attrs={
+                "type": "image/webp",
+                "srcset": _format_srcset(webp, suffix),
+                "sizes": img["sizes"],
+            })
+            img.wrap(picture)
+            picture.insert(0, source)
 
     return str(soup)
+
+
+def _split_suffix(url):
+    """Splits a URL into its path and its query/fragment ("a.jpg?v=1#x" -> "a.jpg", "?v=1#x")"""
+    for i, char in enumerate(url):
+        if char in "?#":
+            return url[0:i], url[i:]
+    return url, ""
+
+
+def _format_srcset(variants, suffix=""):
+    return ", ".join(f"{url}{suffix} {width}w" for url, width in variants)
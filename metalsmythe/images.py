@@ -0,0 +1,205 @@
+import os
+import glob
+import shutil
+import hashlib
+from .cache import cache_key, open_cache_store
+
+# NOTE: Pillow is imported inside the functions that use it so that importing this module
+#       (ex: through build.py) stays cheap until images are actually processed.
+
+
+# Bump this if the way derivatives are generated changes so old cache entries are ignored
+CACHE_VERSION = 1
+
+IMAGE_TYPES = {
+    ".jpg": ("JPEG", "image/jpeg"),
+    ".jpeg": ("JPEG", "image/jpeg"),
+    ".png": ("PNG", "image/png"),
+}
+
+FORMAT_EXTENSIONS = {
+    "JPEG": ".jpg",
+    "PNG": ".png",
+    "WEBP": ".webp",
+}
+
+
+def hash_file(path):
+    """Returns the SHA-256 hex digest of the file's contents"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as fp:
+        for chunk in iter(lambda: fp.read(65536), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def derivative_key(source_hash, width, format, quality):
+    """Returns the content-addressed cache key for a derivative.  The key only depends on the
+    source image's contents, the parameters used to generate it and the Pillow version (since
+    encoders can change between versions), so unchanged images map to the same key on every
+    build and on every machine.
+    """
+    import PIL
+    return cache_key("image", source_hash, width, format, quality, CACHE_VERSION, PIL.__version__)
+
+
+def make_derivative(src_path, dst_path, width, format, quality):
+    """Resizes the image at 'src_path' to the given width (preserving the aspect ratio) and
+    saves it to 'dst_path' in the given PIL format.  The file is written to a temporary
+    name first and then moved into place so that concurrent builds never see partial files.
+    """
+    from PIL import Image
+    with Image.open(src_path) as img:
+        if img.width > width:
+            height = round(img.height * width / img.width)
+            img = img.resize((width, height), Image.LANCZOS)
+        if format == "JPEG" and img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+
+        os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+        tmp_path = f"{dst_path}.{os.getpid()}.tmp"
+        img.save(tmp_path, format=format, quality=quality, optimize=True)
+        os.replace(tmp_path, dst_path)
+    return dst_path
+
+
+def _make_derivative(args):
+    return make_derivative(*args)
+
+
+def resize_images(src_dir, dst_dir, url_base, widths=[480, 960, 1440], pattern="**/*",
+                  webp=True, quality=80, cache=".cache/images", processes=None, progress=None,
+                  objects=None):
+    """Generates resized (and re-encoded) derivatives for all images in 'src_dir' and writes them
+    to 'dst_dir' next to where the originals would be copied.  For an image "blog/photo.jpg" this
+    writes files such as "blog/photo-480w.jpg" and "blog/photo-480w.webp".  WebP derivatives are
+    only created if 'webp' is True and the local Pillow build supports it.  Widths larger than the
+    original image are skipped, and the original width is always included.
+
+    Derivatives are cached in 'cache' (a CacheStore or a location for open_cache_store()) under
+    a key derived from the source image's hash and the parameters used (see derivative_key()),
+    so images that haven't changed are never reprocessed.  Missing derivatives are generated in
+    parallel across a process pool.
+
+    Returns a dict mapping the URL of each original image (url_base + relative path) to:
+
+        {"width": ..., "height": ..., "type": "image/jpeg",
+         "variants": {"image/jpeg": [(url, width), ...], "image/webp": [(url, width), ...]}}
+
+    which can be passed to Builder.srcset_images().  If 'progress' (a ProgressReporter, see
+    metalsmythe.progress) is given, each derivative is reported to it as an "images" stage.
+    If an ObjectStore (see metalsmythe.objects) is given, the derivatives are linked from it
+    instead of being written (or copied) to 'dst_dir'.
+    """
+    from PIL import Image, features
+
+    cache = open_cache_store(cache)
+    formats = []
+    if webp and features.check("webp"):
+        formats.append("WEBP")
+
+    images = {}
+    outputs = {}  # cache key -> list of output paths
+    jobs = {}  # cache key -> job for make_derivative()
+    digests = {}  # cache key -> ObjectStore digest (if 'objects' is given)
+
+    glob_pattern = os.path.join(src_dir, pattern)
+    for path in sorted(glob.glob(glob_pattern, recursive=True)):
+        base, ext = os.path.splitext(path)
+        if ext.lower() not in IMAGE_TYPES or not os.path.isfile(path):
+            continue
+
+        orig_format, mime_type = IMAGE_TYPES[ext.lower()]
+        rel_base = os.path.relpath(base, src_dir).replace('\\', '/')
+        with Image.open(path) as img:
+            orig_width, orig_height = img.size
+
+        source_hash = hash_file(path)
+        image_widths = sorted(set([w for w in widths if w < orig_width] + [orig_width]))
+
+        image = {
+            "width": orig_width,
+            "height": orig_height,
+            "type": mime_type,
+            "variants": {},
+        }
+        for format in [orig_format] + formats:
+            file_ext = FORMAT_EXTENSIONS[format]
+            variant_type = "image/webp" if format == "WEBP" else mime_type
+            variants = image["variants"].setdefault(variant_type, [])
+            for width in image_widths:
+                key = derivative_key(source_hash, width, format, quality)
+                rel_path = f"{rel_base}-{width}w{file_ext}"
+                dst_path = os.path.join(dst_dir, rel_path)
+                if key not in outputs:
+                    jobs[key] = (path, dst_path, width, format, quality)
+                outputs.setdefault(key, []).append(dst_path)
+                variants.append((url_base.rstrip("/") + "/" + rel_path, width))
+
+        url = url_base.rstrip("/") + "/" + os.path.relpath(path, src_dir).replace('\\', '/')
+        images[url] = image
+
+    workers = processes or os.cpu_count() or 1
+    if progress is not None:
+        progress.start_stage("images", len(jobs), workers)
+
+    # write cached derivatives straight to the output and only generate the rest
+    for key in list(jobs.keys()):
+        data = cache.get(key) if cache is not None else None
+        if progress is not None:
+            progress.cache_result(data is not None)
+        if data is not None:
+            dst_path = jobs.pop(key)[1]
+            token = progress.start_file(dst_path) if progress is not None else None
+            if objects is not None:
+                digests[key] = objects.put(data)
+                objects.materialize(digests[key], dst_path)
+            else:
+                os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+                with open(dst_path, "wb") as fp:
+                    fp.write(data)
+            if token is not None:
+                progress.finish_file(token)
+
+    if jobs:
+        from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # jobs are submitted one per worker at a time, so the ones reported as in flight
+            # are the ones actually being processed (and not just waiting in the queue)
+            pending = {}
+            for job in jobs.values():
+                if len(pending) >= workers:
+                    done, not_done = wait(pending.keys(), return_when=FIRST_COMPLETED)
+                    for future in done:
+                        _finish_job(future, pending.pop(future), progress)
+                token = progress.start_file(job[1], thread=False) if progress is not None else None
+                pending[executor.submit(_make_derivative, job)] = token
+            for future in list(pending.keys()):
+                _finish_job(future, pending.pop(future), progress)
+        for key, job in jobs.items():
+            if cache is not None:
+                with open(job[1], "rb") as fp:
+                    cache.put(key, fp.read())
+            if objects is not None:
+                # (replaces the generated file with a link to the store)
+                digests[key] = objects.put_file(job[1])
+                objects.materialize(digests[key], job[1])
+
+    # identical images at different paths share a single derivative
+    for key, paths in outputs.items():
+        for dst_path in paths[1:]:
+            if objects is not None:
+                objects.materialize(digests[key], dst_path)
+            else:
+                os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+                shutil.copyfile(paths[0], dst_path)
+
+    if progress is not None:
+        progress.end_stage()
+    return images
+
+
+def _finish_job(future, token, progress):
+    future.result()  # (re-raises errors from the worker)
+    if token is not None:
+        progress.finish_file(token)
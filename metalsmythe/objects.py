@@ -0,0 +1,203 @@
+import os
+import json
+import mmap
+import shutil
+import struct
+import hashlib
+
+
+class ObjectStore(object):
+    """Content-addressed store for build outputs.  Each distinct file content is stored once
+    ("<directory>/<digest[0:2]>/<digest>") and output files are materialized as hard links to
+    it, so identical outputs (within a build or across builds) are only written to disk once.
+    If hard links aren't supported (ex: the store is on a different drive than the output),
+    files are copied instead.  Example:
+
+        objects = ObjectStore(".cache/objects")
+        objects.materialize(objects.put(b"<html>...</html>"), "build/index.html")
+
+    Since materialized files share their data with the store, they must be replaced (ex: with
+    os.replace()) rather than modified in place.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.can_link = True
+
+    def path(self, digest):
+        return os.path.join(self.directory, digest[0:2], digest)
+
+    def put(self, data):
+        """Stores 'data' (bytes) and returns its digest.  Nothing is written if an object with
+        the same contents already exists."""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{id(data)}.tmp"
+            with open(tmp_path, "wb") as fp:
+                fp.write(data)
+            os.replace(tmp_path, path)
+        return digest
+
+    def put_file(self, src_path):
+        """Stores a copy of the file at 'src_path' and returns its digest.  (The source is
+        copied rather than linked since it may be edited in place later.)"""
+        digest = hashlib.sha256()
+        with open(src_path, "rb") as fp:
+            for chunk in iter(lambda: fp.read(1 << 20), b""):
+                digest.update(chunk)
+        digest = digest.hexdigest()
+        path = self.path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            shutil.copyfile(src_path, tmp_path)
+            os.replace(tmp_path, path)
+        return digest
+
+    def materialize(self, digest, dst_path):
+        """Creates 'dst_path' as a hard link to (or a copy of) the object with the given digest,
+        replacing any existing file."""
+        os.makedirs(os.path.dirname(dst_path) or ".", exist_ok=True)
+        tmp_path = f"{dst_path}.{os.getpid()}.tmp"
+        if self.can_link:
+            try:
+                os.link(self.path(digest), tmp_path)
+            except OSError:
+                self.can_link = False
+        if not self.can_link:
+            shutil.copyfile(self.path(digest), tmp_path)
+        os.replace(tmp_path, dst_path)
+
+    def prune(self):
+        """Removes objects that aren't linked from any output (i.e. whose link count is 1) and
+        returns the number removed.  Since outputs are hard links, this removes everything
+        that isn't part of the outputs that currently exist (ex: the pages replaced by the
+        latest build).  Nothing is removed if the store has had to fall back to copying,
+        since then every object looks unused."""
+        if not self.can_link:
+            return 0
+        removed = 0
+        for dir_path, dir_names, file_names in os.walk(self.directory):
+            for file_name in file_names:
+                path = os.path.join(dir_path, file_name)
+                if os.stat(path).st_nlink == 1:
+                    os.remove(path)
+                    removed += 1
+        return removed
+
+
+# Pack file layout:
+#
+#   PACK_MAGIC | data... | index (JSON) | index offset (u64) | index size (u64) | PACK_MAGIC
+#
+# The index maps each file path to [offset, size, mtime].  Identical files share their data.
+PACK_MAGIC = b"MSPACK01"
+_PACK_FOOTER = struct.Struct("<QQ8s")
+
+
+def pack_directory(directory, pack_path):
+    """Packs all files in 'directory' into a single indexed archive at 'pack_path' (see
+    PackedSite).  Files with identical contents are stored once.  Returns a dict with the
+    number of "files", the number of "unique" contents, and the total "size" of the data."""
+    index = {}
+    offsets = {}
+    tmp_path = f"{pack_path}.{os.getpid()}.tmp"
+    os.makedirs(os.path.dirname(pack_path) or ".", exist_ok=True)
+    with open(tmp_path, "wb") as fp:
+        fp.write(PACK_MAGIC)
+        for dir_path, dir_names, file_names in os.walk(directory):
+            dir_names.sort()
+            for file_name in sorted(file_names):
+                full_path = os.path.join(dir_path, file_name)
+                path = os.path.relpath(full_path, directory).replace('\\', '/')
+                with open(full_path, "rb") as src:
+                    data = src.read()
+                digest = hashlib.sha256(data).digest()
+                if digest not in offsets:
+                    offsets[digest] = fp.tell()
+                    fp.write(data)
+                index[path] = [offsets[digest], len(data), int(os.path.getmtime(full_path))]
+
+        size = fp.tell() - len(PACK_MAGIC)
+        index_data = json.dumps(index, sort_keys=True).encode("utf-8")
+        index_offset = fp.tell()
+        fp.write(index_data)
+        fp.write(_PACK_FOOTER.pack(index_offset, len(index_data), PACK_MAGIC))
+    os.replace(tmp_path, pack_path)
+    return {"files": len(index), "unique": len(offsets), "size": size}
+
+
+class PackedSite(object):
+    """Read-only access to an archive created by pack_directory().  The archive is memory
+    mapped, so file contents are returned as memoryviews without copying or unpacking
+    anything.  The views remain valid after the archive is closed.  Example:
+
+        with PackedSite("site.pack") as site:
+            data = site.get("index.html")
+
+    @param pack_path Path to the archive
+    """
+
+    def __init__(self, pack_path):
+        self.fp = open(pack_path, "rb")
+        try:
+            self.map = mmap.mmap(self.fp.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self.fp.close()
+            raise ValueError(f"Not a pack file: '{pack_path}'")
+        self.view = memoryview(self.map)
+
+        footer_start = len(self.map) - _PACK_FOOTER.size
+        if footer_start < len(PACK_MAGIC) or self.map[0:len(PACK_MAGIC)] != PACK_MAGIC:
+            self.close()
+            raise ValueError(f"Not a pack file: '{pack_path}'")
+        index_offset, index_size, magic = _PACK_FOOTER.unpack(self.map[footer_start:])
+        if magic != PACK_MAGIC:
+            self.close()
+            raise ValueError(f"Not a pack file: '{pack_path}'")
+        self.files = json.loads(self.map[index_offset:index_offset + index_size].decode("utf-8"))
+
+        self.dirs = {""}
+        for path in self.files.keys():
+            while "/" in path:
+                path = path.rsplit("/", 1)[0]
+                self.dirs.add(path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def close(self):
+        """Closes the archive.  Memoryviews returned by get() stay valid: if any are still in
+        use, the mapping is only unmapped once the last of them has been released."""
+        if getattr(self, "view", None) is not None:
+            self.view.release()
+            self.view = None
+        try:
+            self.map.close()
+        except BufferError:
+            pass  # (unmapped when the outstanding views are garbage collected)
+        self.fp.close()
+
+    def isfile(self, path):
+        return path in self.files
+
+    def isdir(self, path):
+        return path.strip("/") in self.dirs
+
+    def get(self, path):
+        """Returns the contents of the file at 'path' (relative to the packed directory) as a
+        memoryview, or None if there is no such file."""
+        entry = self.files.get(path)
+        if entry is None:
+            return None
+        offset, size = entry[0], entry[1]
+        return self.view[offset:offset + size]
+
+    def mtime(self, path):
+        return self.files[path][2]
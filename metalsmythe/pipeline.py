@@ -0,0 +1,281 @@
+import os
+import hashlib
+from .cache import hash_value, cache_key, open_cache_store
+from .builder import markdown_to_html, apply_layout, write_file
+from .html import prefix_links, srcset_images
+
+
+class Stage(object):
+    """A single step in a Pipeline.  Stages come in two kinds:
+
+      per_file=False - func(builder) is called once and may work across all files (loading
+                       files, creating collections, etc.)
+      per_file=True  - func(file, metadata) is called for each file and may only change that
+                       file.  These stages can run concurrently and adjacent per-file stages
+                       are fused so that each file passes through all of them in one go.
+
+    Per-file stages also declare what they read and write so that their results can be cached:
+
+    @param inputs File properties the stage reads (None = the whole file)
+    @param outputs File properties the stage writes.  Only these are cached.
+    @param metadata Global metadata keys the stage reads (None = all of the metadata)
+    @param barrier If True, all earlier stages must finish for every file before this stage
+                   starts, and later stages only start once it has finished for every file.
+                   Its outputs are applied to the files only at the end, so while it runs it
+                   always sees the other files as they were before it started.  Use this for
+                   stages that read other files (ex: through collections).
+    @param cache If True, outputs are memoized by a hash of the stage's inputs
+    @param key Optional function returning extra data to include in the cache key (ex: a
+               hash of the templates a stage uses)
+    """
+
+    def __init__(self, name, func, per_file=False, inputs=None, outputs=["path", "contents"],
+                 metadata=[], barrier=False, cache=False, key=None):
+        self.name = name
+        self.func = func
+        self.per_file = per_file
+        self.inputs = inputs
+        self.outputs = outputs
+        self.metadata = metadata
+        self.barrier = barrier
+        self.cache = cache
+        self.key = key
+
+    def __repr__(self):
+        return f"Stage({self.name!r}, per_file={self.per_file})"
+
+
+class Pipeline(object):
+    """Runs a declarative list of stages against a Builder.  Example:
+
+        pipeline = Pipeline(builder, cache=".cache/store", workers=4)
+        pipeline.add(Stage("load", lambda b: b.load_files("**/*.md", base_dir="src/content")))
+        pipeline.add(markdown_stage())
+        pipeline.add(layouts_stage(jinja_env, default_layout="simple.html"))
+        pipeline.add(write_stage("build"))
+        pipeline.run()
+
+    Stages are grouped before running: each across-file stage and each barrier stage runs on
+    its own, and runs of other adjacent per-file stages are fused into a single pass over the
+    files.  Per-file passes are spread across 'workers' threads.  Cached per-file outputs are kept in
+    memory and, if 'cache' is given (a CacheStore or a location for open_cache_store()), in
+    that store so that they are reused between builds (and machines).  If 'progress' (a
+    ProgressReporter, see metalsmythe.progress) is given, each group's progress is reported
+    to it as the pipeline runs.
+    """
+
+    def __init__(self, builder, stages=[], cache=None, workers=1, progress=None):
+        self.builder = builder
+        self.stages = list(stages)
+        self.cache = open_cache_store(cache)
+        self.workers = workers
+        self.progress = progress
+        self.memo = {}
+
+    def add(self, stage):
+        """Appends a stage to the pipeline (and returns it)"""
+        self.stages.append(stage)
+        return stage
+
+    def groups(self):
+        """Returns the stages grouped as they will be run: a list of lists where each list is
+        either a single across-file stage or a run of fused per-file stages."""
+        groups = []
+        for stage in self.stages:
+            fuse = (stage.per_file and not stage.barrier and groups and groups[-1][-1].per_file
+                    and not groups[-1][-1].barrier)
+            if fuse:
+                groups[-1].append(stage)
+            else:
+                groups.append([stage])
+        return groups
+
+    def run(self):
+        """Runs all stages in order"""
+        for group in self.groups():
+            if not group[0].per_file:
+                self._run_across_files(group[0])
+            else:
+                self._run_per_file(group)
+
+    def _run_across_files(self, stage):
+        if self.progress is None:
+            stage.func(self.builder)
+            return
+
+        with self.progress.stage(stage.name):
+            stage.func(self.builder)
+
+    def _run_per_file(self, stages):
+        # A barrier stage reads other files (see Stage 'barrier') and runs in a group of its own.
+        # It works on copies of the files and its outputs are only applied once every file is
+        # done, so what it reads (and its cache keys) never depend on thread timing.
+        barrier = stages[0].barrier
+        results = {}
+
+        def _run(file):
+            token = self.progress.start_file(file["path"]) if self.progress is not None else None
+            if barrier:
+                copy = dict(file)
+                self._run_stage(stages[0], copy)
+                results[id(file)] = {name: copy[name] for name in stages[0].outputs if name in copy}
+            else:
+                for stage in stages:
+                    self._run_stage(stage, file)
+            if token is not None:
+                self.progress.finish_file(token)
+
+        if self.progress is not None:
+            self.progress.start_stage("+".join(stage.name for stage in stages),
+                                      len(self.builder.files), self.workers)
+
+        if self.workers == 1:
+            for file in self.builder.files:
+                _run(file)
+        else:
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                list(executor.map(_run, self.builder.files))
+
+        for file in self.builder.files:
+            file.update(results.get(id(file), {}))
+
+        if self.progress is not None:
+            self.progress.end_stage()
+
+    def _run_stage(self, stage, file):
+        metadata = self.builder.metadata
+        if not stage.cache:
+            stage.func(file, metadata)
+            return
+
+        key = self._cache_key(stage, file, metadata)
+        outputs = self._load(key)
+        if self.progress is not None:
+            self.progress.cache_result(outputs is not None)
+        if outputs is None:
+            stage.func(file, metadata)
+            outputs = {name: file[name] for name in stage.outputs if name in file}
+            self._save(key, outputs)
+        else:
+            file.update(outputs)
+
+    def _cache_key(self, stage, file, metadata):
+        if stage.inputs is None:
+            file_inputs = file
+        else:
+            file_inputs = {name: file.get(name) for name in stage.inputs}
+        if stage.metadata is None:
+            metadata_inputs = metadata
+        else:
+            metadata_inputs = {name: metadata.get(name) for name in stage.metadata}
+        extra = stage.key() if stage.key is not None else None
+        return cache_key("stage", stage.name, extra, file_inputs, metadata_inputs)
+
+    def _load(self, key):
+        if key in self.memo:
+            return self.memo[key]
+        if self.cache is None:
+            return None
+
+        outputs = self.cache.get_json(key)
+        if outputs is not None:
+            self.memo[key] = outputs
+        return outputs
+
+    def _save(self, key, outputs):
+        # outputs that can't be serialized as JSON are only cached in memory
+        self.memo[key] = outputs
+        if self.cache is not None:
+            self.cache.put_json(key, outputs)
+
+
+def hash_directory(directory):
+    """Returns a hash of the names and contents of all files in a directory.  This is useful
+    as a Stage 'key' so that cached outputs are invalidated when templates change."""
+    digest = hashlib.sha256()
+    for root, dirs, files in sorted(os.walk(directory)):
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            digest.update(os.path.relpath(path, directory).replace('\\', '/').encode("utf-8"))
+            with open(path, "rb") as fp:
+                digest.update(hashlib.sha256(fp.read()).digest())
+    return digest.hexdigest()
+
+
+def _constant_key(value):
+    # stage options don't change during a build, so they are only hashed once
+    digest = hash_value(value)
+    return lambda: digest
+
+
+def _has_extension(file, file_extensions):
+    return any(file["path"].endswith(file_ext) for file_ext in file_extensions)
+
+
+def markdown_stage(file_extensions=[".md", ".markdown"], markdown_extensions=["extra"]):
+    """Per-file stage for Builder.markdown_to_html()"""
+    return Stage("markdown",
+                 lambda file, metadata: markdown_to_html(file, file_extensions, markdown_extensions),
+                 per_file=True, inputs=["path", "contents"], outputs=["path", "contents"],
+                 cache=True, key=_constant_key([file_extensions, markdown_extensions]))
+
+
+def layouts_stage(jinja_env, default_layout=None, dotmap=True, template_dir=None, key=None):
+    """Per-file stage for Builder.apply_layouts().  Layouts can read other files (through
+    collections), so this stage is a barrier.  Since templates see all of the metadata,
+    results are only cached if 'template_dir' is given (so changes to templates can be
+    detected), and even then only reused if the metadata is unchanged.
+
+    Anything else the templates depend on that changes between builds (ex: the asset manifest
+    used by an "asset_url" filter) must be passed as 'key', or stale pages will be reused.
+    Example:
+
+        layouts_stage(jinja_env, template_dir="layouts", key=manifest)
+
+    @param key Extra (JSON-like) data that invalidates cached results when it changes
+    """
+    return Stage("layouts",
+                 lambda file, metadata: apply_layout(file, jinja_env, metadata, default_layout, dotmap),
+                 per_file=True, inputs=None, outputs=["contents"], metadata=None, barrier=True,
+                 cache=template_dir is not None,
+                 key=_constant_key([template_dir and hash_directory(template_dir), default_layout,
+                                    dotmap, key]))
+
+
+def srcset_stage(images, sizes="100vw", file_extensions=[".html", ".htm"]):
+    """Per-file stage for Builder.srcset_images()"""
+    def _srcset(file, metadata):
+        if _has_extension(file, file_extensions):
+            file["contents"] = srcset_images(file["contents"], images, sizes)
+    return Stage("srcset", _srcset, per_file=True, inputs=["path", "contents"],
+                 outputs=["contents"], cache=True, key=_constant_key([images, sizes, file_extensions]))
+
+
+def prefix_stage(prefix, selectors=["a", "link", "script", "img", "video", "audio", "source"],
+                 file_extensions=[".html", ".htm"]):
+    """Per-file stage for Builder.prefix_links()"""
+    def _prefix(file, metadata):
+        if _has_extension(file, file_extensions):
+            file["contents"] = prefix_links(file["contents"], prefix, selectors)
+    return Stage("prefix", _prefix, per_file=True, inputs=["path", "contents"],
+                 outputs=["contents"], cache=True, key=_constant_key([prefix, selectors, file_extensions]))
+
+
+def postprocess_stage(file_extensions=[".html", ".htm"], **options):
+    """Per-file stage for Builder.postprocess_html().  Keyword arguments are passed on to
+    metalsmythe.postprocess.postprocess_html()."""
+    from .postprocess import postprocess_html
+
+    def _postprocess(file, metadata):
+        if _has_extension(file, file_extensions):
+            file["contents"] = postprocess_html(file["contents"], **options)
+    return Stage("postprocess", _postprocess, per_file=True, inputs=["path", "contents"],
+                 outputs=["contents"], cache=True, key=_constant_key([options, file_extensions]))
+
+
+def write_stage(output_dir, objects=None):
+    """Per-file stage that writes each file to 'output_dir' (see Builder.write())"""
+    return Stage("write", lambda file, metadata: write_file(file, output_dir, objects),
+                 per_file=True, inputs=["path", "contents"], outputs=[])
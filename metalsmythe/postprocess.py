@@ -0,0 +1,296 @@
+import os
+import re
+import glob
+import warnings
+from html import escape
+from html.parser import HTMLParser
+from .html import LINK_ATTRS, _rewrite_srcset
+from .cache import cache_key, open_cache_store
+
+
+# Elements that never have content (and are written without a closing tag)
+VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta",
+             "source", "track", "wbr"}
+
+# Elements where whitespace is significant and must be preserved
+PRESERVE_TAGS = {"pre", "textarea", "script"}
+
+# Block-level (or non-rendered) elements.  Whitespace next to these tags is not
+# significant, so it can be dropped rather than collapsed to a single space.
+BLOCK_TAGS = {"html", "head", "body", "title", "meta", "link", "script", "style", "base",
+              "header", "footer", "main", "nav", "section", "article", "aside", "div", "p",
+              "h1", "h2", "h3", "h4", "h5", "h6", "ul", "ol", "li", "dl", "dt", "dd",
+              "table", "thead", "tbody", "tfoot", "tr", "th", "td", "form", "fieldset",
+              "blockquote", "figure", "figcaption", "hr", "br", "pre", "source",
+              "address", "details", "summary"}
+
+_WHITESPACE = re.compile(r"\s+")
+_CSS_PUNCTUATION = re.compile(r"\s*([{};,>])\s*")
+_CSS_COLON = re.compile(r":\s+")
+_CSS_TOKENS = re.compile(r"""/\*.*?\*/|"(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*'|url\([^)]*\)""",
+                         re.DOTALL | re.IGNORECASE)
+_CSS_RELATIVE_URL = re.compile(r"url\(\s*['\"]?(?!/|data:|https?:)", re.IGNORECASE)
+
+
+def minify_css(css):
+    """Performs a simple, safe minification of CSS: comments are removed, whitespace is
+    collapsed, and whitespace around punctuation is dropped.  Quoted strings and url()
+    values are left exactly as they are.  Example:
+
+        >>> minify_css("p::before {  content: ' ; ' ;  }")
+        "p::before{content:' ; '}"
+
+    """
+    # split the CSS into quoted strings/url()s, which are kept, and the text between them
+    # (with comments dropped), which is minified
+    chunks = [""]
+    pos = 0
+    for match in _CSS_TOKENS.finditer(css):
+        chunks[-1] += css[pos:match.start()]
+        if not match.group(0).startswith("/*"):
+            chunks += [match.group(0), ""]
+        pos = match.end()
+    chunks[-1] += css[pos:]
+
+    for i in range(0, len(chunks), 2):
+        text = _WHITESPACE.sub(" ", chunks[i])
+        text = _CSS_PUNCTUATION.sub(r"\1", text)
+        text = _CSS_COLON.sub(":", text)  # (whitespace before ':' can be a descendant selector)
+        chunks[i] = text.replace(";}", "}")
+    css = "".join(chunks).strip()
+    return css
+
+
+def load_inline_css(asset_dir, url_base, paths, max_size=1024):
+    """Loads the style sheets that should be inlined into pages by postprocess_html().  Inlining
+    is opt-in per style sheet since inlined CSS is sent again with every page rather than
+    cached: only list small, critical style sheets in 'paths' (paths or glob patterns relative
+    to 'asset_dir').  Returns a dict mapping each style sheet's URL (url_base + relative path)
+    to its minified contents.  Example:
+
+        inline_css = load_inline_css("build/assets", "/assets", ["critical.css"])
+
+    Files larger than 'max_size' bytes are skipped with a warning, as are files with relative
+    url() references (since those would resolve differently once the CSS is moved into the page).
+    """
+    inline_css = {}
+    for pattern in paths:
+        for path in sorted(glob.glob(os.path.join(asset_dir, pattern), recursive=True)):
+            if not os.path.isfile(path):
+                continue
+            if os.path.getsize(path) > max_size:
+                warnings.warn(f"Not inlining '{path}' since it is larger than {max_size} bytes")
+                continue
+
+            with open(path) as fp:
+                css = fp.read()
+            if _CSS_RELATIVE_URL.search(css):
+                warnings.warn(f"Not inlining '{path}' since it has relative url() references")
+                continue
+
+            rel_path = os.path.relpath(path, asset_dir).replace('\\', '/')
+            inline_css[url_base.rstrip("/") + "/" + rel_path] = minify_css(css)
+
+    return inline_css
+
+
+class HTMLPostProcessor(HTMLParser):
+    """Single-pass HTML rewriter built on the tokenizer from html.parser.  As tags stream past,
+    link attributes are rewritten with 'rewrite_url', small style sheets are replaced with
+    inline <style> elements (see load_inline_css()), and, if 'minify' is True, comments are
+    dropped and insignificant whitespace is removed.  Unlike BeautifulSoup, no tree is built.
+    """
+
+    def __init__(self, rewrite_url=None, selectors=["a", "link", "script", "img", "video", "audio", "source"],
+                 minify=True, inline_css=None):
+        super().__init__(convert_charrefs=False)
+        self.rewrite_url = rewrite_url
+        self.selectors = set(selectors)
+        self.minify = minify
+        self.inline_css = inline_css or {}
+        self.out = []
+        self.preserve = 0
+        self.pending_space = False
+        self.last_tag = None
+        self.in_style = False
+
+    def process(self, html):
+        self.feed(html)
+        self.close()
+        self._flush_space(None)
+        return "".join(self.out)
+
+    def _flush_space(self, tag):
+        # whitespace next to a block-level tag is dropped; otherwise it collapses to one space
+        if self.pending_space:
+            if tag not in BLOCK_TAGS and self.last_tag not in BLOCK_TAGS:
+                self.out.append(" ")
+            self.pending_space = False
+
+    def _format_attrs(self, tag, attrs):
+        link_attrs = LINK_ATTRS.get(tag, []) if tag in self.selectors else []
+        parts = []
+        for name, value in attrs:
+            if value is None:
+                parts.append(" " + name)
+                continue
+            if self.rewrite_url is not None and name in link_attrs:
+                if name == "srcset":
+                    value = _rewrite_srcset(value, self.rewrite_url)
+                else:
+                    value = self.rewrite_url(value)
+            parts.append(f' {name}="{escape(value)}"')
+        return "".join(parts)
+
+    def _inline_style(self, tag, attrs):
+        # returns a <style> element for <link rel="stylesheet"> tags that can be inlined
+        if tag != "link" or not self.inline_css:
+            return None
+        attrs = dict(attrs)
+        if (attrs.get("rel") or "").lower() != "stylesheet" or attrs.get("media") not in (None, "all"):
+            return None
+        css = self.inline_css.get(attrs.get("href"))
+        if css is None:
+            return None
+        return f"<style>{css}</style>"
+
+    def handle_starttag(self, tag, attrs):
+        self._emit_tag(tag, attrs, self_closing=False)
+
+    def handle_startendtag(self, tag, attrs):
+        self._emit_tag(tag, attrs, self_closing=True)
+
+    def _emit_tag(self, tag, attrs, self_closing):
+        if self.minify:
+            self._flush_space(tag)
+
+        inline = self._inline_style(tag, attrs)
+        if inline is not None:
+            self.out.append(inline)
+        else:
+            end = "/>" if self_closing and tag not in VOID_TAGS else ">"
+            self.out.append(f"<{tag}{self._format_attrs(tag, attrs)}{end}")
+
+        self.last_tag = tag
+        if not self_closing and tag not in VOID_TAGS:
+            if tag in PRESERVE_TAGS:
+                self.preserve += 1
+            elif tag == "style":
+                self.in_style = True
+
+    def handle_endtag(self, tag):
+        if self.minify:
+            if tag in VOID_TAGS:
+                return  # stray end tags for void elements (ex: "</meta>") are ignored by browsers
+            self._flush_space(tag)
+        self.out.append(f"</{tag}>")
+        self.last_tag = tag
+        if tag in PRESERVE_TAGS:
+            self.preserve = max(0, self.preserve - 1)
+        elif tag == "style":
+            self.in_style = False
+
+    def handle_data(self, data):
+        if not self.minify or self.preserve:
+            self.out.append(data)
+        elif self.in_style:
+            self.out.append(minify_css(data))
+        elif data.isspace():
+            self.pending_space = True
+        else:
+            if data[0].isspace():
+                self.pending_space = True
+            self._flush_space("#text")
+            text = _WHITESPACE.sub(" ", data.strip())
+            self.out.append(text)
+            self.last_tag = "#text"
+            self.pending_space = data[-1].isspace()
+
+    def handle_entityref(self, name):
+        self._flush_text()
+        self.out.append(f"&{name};")
+
+    def handle_charref(self, name):
+        self._flush_text()
+        self.out.append(f"&#{name};")
+
+    def _flush_text(self):
+        if self.minify and not self.preserve:
+            self._flush_space("#text")
+            self.last_tag = "#text"
+
+    def handle_comment(self, data):
+        # conditional comments ("<!--[if IE]>") are kept since they affect rendering
+        if not self.minify or data.startswith("[if") or data.endswith("<![endif]"):
+            self.out.append(f"<!--{data}-->")
+
+    def handle_decl(self, decl):
+        self.out.append(f"<!{decl}>")
+
+    def unknown_decl(self, data):
+        self.out.append(f"<![{data}]>")
+
+    def handle_pi(self, data):
+        self.out.append(f"<?{data}>")
+
+
+def postprocess_html(html, prefix="", manifest=None,
+                     selectors=["a", "link", "script", "img", "video", "audio", "source"],
+                     minify=True, inline_css=None):
+    """Runs the fused post-processing pass over an HTML document: links are rewritten using
+    the fingerprint 'manifest' (see metalsmythe.assets) and then prefixed with 'prefix' (as in
+    prefix_links()), small style sheets in 'inline_css' are inlined, and the markup is minified.
+    This is done in a single tokenizing pass rather than one BeautifulSoup parse per step.
+    Whitespace around inline elements (such as the <picture> added by srcset_images()) is
+    kept, since it is rendered:
+
+        >>> postprocess_html('<p>a\\n<picture><img src="/x.png"></picture> b</p>')
+        '<p>a <picture><img src="/x.png"></picture> b</p>'
+
+    """
+    if prefix and not prefix.startswith('/'):
+        prefix = '/' + prefix
+    prefix = prefix.rstrip('/')
+
+    def _rewrite(url):
+        if manifest is not None:
+            url = manifest.get(url, url)
+        return prefix + url if prefix and url.startswith('/') else url
+
+    # pages usually link to the fingerprinted style sheets (see asset_url_filter()), so the
+    # style sheets to inline are looked up by both their original and fingerprinted URLs
+    if inline_css and manifest:
+        inline_css = dict(inline_css)
+        inline_css.update({manifest[url]: css for url, css in inline_css.items() if url in manifest})
+
+    rewrite_url = _rewrite if prefix or manifest else None
+    processor = HTMLPostProcessor(rewrite_url, selectors, minify=minify, inline_css=inline_css)
+    return processor.process(html)
+
+
+def _postprocess_cached(args):
+    """Worker for Builder.postprocess_html().  Results are cached in the CacheStore by a hash
+    of the input and the options, so unchanged pages are not processed again."""
+    html, options, cache = args
+    if cache is None:
+        return postprocess_html(html, **options)
+
+    key = cache_key("postprocess", options, html)
+    result = cache.get_text(key)
+    if result is None:
+        result = postprocess_html(html, **options)
+        cache.put_text(key, result)
+    return result
+
+
+def postprocess_files(contents, options, cache=None, processes=1):
+    """Runs postprocess_html(html, **options) over a list of HTML strings, optionally
+    across a process pool.  Returns the results in the same order.  'cache' can be a
+    CacheStore or a location for open_cache_store()."""
+    jobs = [(html, options, open_cache_store(cache)) for html in contents]
+    if processes == 1 or len(jobs) < 2:
+        return [_postprocess_cached(job) for job in jobs]
+
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        return list(executor.map(_postprocess_cached, jobs, chunksize=8))
@@ -0,0 +1,142 @@
+import os
+import glob
+from .builder import Builder, load_file, apply_layout
+from .html import prefix_links
+from .cache import cache_key, open_cache_store
+
+
+class Previewer(object):
+    """Renders single pages on demand without running a full build.  Only the requested page
+    has its markdown converted and its layout applied.  Collections are still created (so
+    pages such as a blog index render correctly), but only from the front-matter of the
+    other pages.  Example:
+
+        previewer = Previewer("src/content", jinja_env, metadata,
+                              collections=lambda b: b.create_collection("blog", "blog/*.md"))
+        html = previewer.render("blog.md")
+
+    A Previewer is meant to be kept around (ex: in a preview server) so that repeated renders
+    are fast: front-matter is only re-read for files that have changed, converted markdown is
+    cached by content, and Jinja2 caches compiled templates (reloading them when they change).
+    Note that other pages' 'contents' in collections are their raw markdown, not HTML.
+    If a 'cache' (a CacheStore or a location for open_cache_store()) is given, parsed
+    front-matter and converted markdown are also shared through it.
+
+    @param base_dir Directory containing the content files
+    @param jinja_env Jinja2.Environment used to load layouts
+    @param metadata Global metadata (as given to Builder)
+    @param collections Function called with a Builder to create collections (ex: the same
+                       create_collection() calls used by the full build)
+    """
+
+    def __init__(self, base_dir, jinja_env, metadata, collections=None, pattern="**/*.md",
+                 default_layout=None, file_extensions=[".md", ".markdown"],
+                 markdown_extensions=["extra"], prefix="", cache=None):
+        self.base_dir = base_dir
+        self.jinja_env = jinja_env
+        self.metadata = dict(metadata)
+        self.collections = collections
+        self.pattern = pattern
+        self.default_layout = default_layout
+        self.file_extensions = file_extensions
+        self.markdown_extensions = markdown_extensions
+        self.prefix = prefix
+        self.cache = open_cache_store(cache)
+        self.index = {}
+        self.markdown_cache = {}
+
+    def load_index(self):
+        """Returns a dict mapping each content file's path to its front-matter (and raw contents).
+        Files are only re-read if their modification time or size has changed."""
+        glob_pattern = os.path.join(self.base_dir, self.pattern)
+        index = {}
+        for full_path in glob.glob(glob_pattern, recursive=True):
+            path = os.path.relpath(full_path, self.base_dir).replace('\\', '/')
+            stat = os.stat(full_path)
+            stamp = (stat.st_mtime_ns, stat.st_size)
+
+            entry = self.index.get(path)
+            if entry is None or entry[0] != stamp:
+                entry = (stamp, self._load_file(path, full_path))
+            index[path] = entry
+
+        self.index = index
+        return {path: entry[1] for path, entry in index.items()}
+
+    def _load_file(self, path, full_path):
+        if self.cache is None:
+            return load_file(path, self.base_dir)
+
+        with open(full_path, "rb") as fp:
+            key = cache_key("frontmatter", path, fp.read())
+        file = self.cache.get_json(key)
+        if file is None:
+            file = load_file(path, self.base_dir)
+            self.cache.put_json(key, file)  # (skipped if the front-matter isn't plain JSON)
+        return file
+
+    def markdown_to_html(self, text):
+        """Converts markdown to HTML, caching the results by a hash of the text"""
+        key = cache_key("markdown", text, self.markdown_extensions)
+        html = self.markdown_cache.get(key)
+        if html is None and self.cache is not None:
+            html = self.cache.get_text(key)
+        if html is None:
+            import markdown
+            html = markdown.markdown(text, extensions=self.markdown_extensions)
+            if self.cache is not None:
+                self.cache.put_text(key, html)
+        self.markdown_cache[key] = html
+        return html
+
+    def render(self, path):
+        """Renders the content file at 'path' (relative to base_dir) and returns the resulting
+        HTML.  Raises KeyError if the file doesn't exist."""
+        path = path.replace('\\', '/')
+        index = self.load_index()
+        if path not in index:
+            raise KeyError(f"No such content file: '{path}'")
+
+        # collections link files together, so they are built from copies of the index.  As in
+        # the full build, collections are created from the source paths and then every file is
+        # given its output path (so links to other pages match), but only the requested file
+        # has its markdown converted.
+        builder = Builder(self.metadata)
+        builder.files = [dict(file) for file in index.values()]
+        if self.collections is not None:
+            self.collections(builder)
+
+        file = next(file for file in builder.files if file["path"] == path)
+        for other in builder.files:
+            other["path"] = self._html_path(other["path"])
+        if file["path"] != path:
+            file["contents"] = self.markdown_to_html(file["contents"])
+
+        apply_layout(file, self.jinja_env, builder.metadata, self.default_layout)
+
+        contents = file["contents"]
+        if self.prefix != "":
+            contents = prefix_links(contents, self.prefix)
+        return contents
+
+    def _html_path(self, path):
+        for file_ext in self.file_extensions:
+            if path.endswith(file_ext):
+                return path[0:len(path) - len(file_ext)] + ".html"
+        return path
+
+    def find(self, url):
+        """Maps a URL path (ex: "/blog" or "/blog/post.html") to the content file that renders
+        it, or returns None if there isn't one."""
+        url = url.split('?', 1)[0].split('#', 1)[0].strip('/')
+        if url == "":
+            url = "index"
+        for suffix in [".html", ".htm"]:
+            if url.endswith(suffix):
+                url = url[0:-len(suffix)]
+        for file_ext in self.file_extensions:
+            candidates = [url + file_ext, url + "/index" + file_ext]
+            for candidate in candidates:
+                if os.path.isfile(os.path.join(self.base_dir, candidate)):
+                    return candidate
+        return None
@@ -0,0 +1,287 @@
+import os
+import sys
+import json
+import time
+import threading
+import traceback
+import contextlib
+
+
+def current_rss():
+    """Returns the resident set size of this process in bytes, or None if it isn't known.
+    On Linux this is the current RSS; elsewhere it is the peak RSS (from getrusage())."""
+    try:
+        with open("/proc/self/statm") as fp:
+            return int(fp.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def _format_bytes(size):
+    if size is None:
+        return "?"
+    for unit in ["B", "KB", "MB", "GB"]:
+        if size < 1024 or unit == "GB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+def _format_seconds(seconds):
+    if seconds is None:
+        return "?"
+    seconds = int(seconds)
+    return f"{seconds // 60}:{seconds % 60:02d}"
+
+
+class _StageProgress(object):
+    # counters for the stage (or fused group of stages) that is currently running
+
+    def __init__(self, name, total, workers):
+        self.name = name
+        self.total = total
+        self.workers = workers
+        self.start = time.monotonic()
+        self.last_finish = self.start
+        self.done = 0
+        self.busy = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.in_flight = {}
+        self.stalled = None
+
+
+class ProgressReporter(object):
+    """Reports the progress of a Pipeline while it runs (see Pipeline 'progress').  For each
+    stage it tracks files done, files/sec, ETA, worker utilisation (the share of the workers'
+    time spent on files), cache hits and the process's RSS, and reports them:
+
+      - as JSON lines written to 'events' (a path or a file object), for CI to parse,
+      - as a single, continuously updated line on 'stream' if it is a terminal, or otherwise
+        as a log line every 'log_interval' seconds and at the end of each stage.
+
+    A watchdog thread also checks for stalls: if no file has finished for 'stall_timeout'
+    seconds, the slowest in-flight file and the stack of the thread working on it are dumped
+    (once per stall).  Stacks aren't available for files processed in other processes (see
+    start_file()).  Example:
+
+        with ProgressReporter(events="build-events.jsonl") as progress:
+            Pipeline(builder, stages, progress=progress).run()
+
+    @param stream Stream for the human readable display (None = no display)
+    @param interval Seconds between updates (and watchdog checks)
+    """
+
+    def __init__(self, events=None, stream=sys.stderr, interval=0.5, log_interval=10.0,
+                 stall_timeout=60.0):
+        self.events = events
+        self.owns_events = isinstance(events, str)
+        if self.owns_events:
+            self.events = open(events, "w")
+        self.stream = stream
+        self.tty = stream is not None and hasattr(stream, "isatty") and stream.isatty()
+        self.interval = interval
+        self.log_interval = log_interval
+        self.stall_timeout = stall_timeout
+        self.current = None
+        self.lock = threading.Lock()
+        self.build_start = time.monotonic()
+        self.last_log = self.build_start
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._watch, name="progress-watchdog", daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def close(self):
+        """Stops the watchdog and writes the final "build_end" event"""
+        if self.stopped.is_set():
+            return
+        self.stopped.set()
+        self.thread.join()
+        self.emit({"event": "build_end",
+                   "elapsed": round(time.monotonic() - self.build_start, 3),
+                   "rss": current_rss()})
+        if self.owns_events:
+            self.events.close()
+
+    def emit(self, event):
+        """Writes an event to the JSON lines stream (if there is one)"""
+        if self.events is None:
+            return
+        event = dict(event, time=round(time.time(), 3))
+        with self.lock:
+            self.events.write(json.dumps(event, default=str) + "\n")
+            self.events.flush()
+
+    def start_stage(self, name, total=None, workers=1):
+        """Called when a stage (or fused group of per-file stages) starts.  'total' is the
+        number of files it will process (None for across-file stages)."""
+        with self.lock:
+            self.current = _StageProgress(name, total, workers)
+        self.emit({"event": "stage_start", "stage": name, "total": total, "workers": workers})
+
+    def end_stage(self):
+        """Called when the current stage is finished"""
+        with self.lock:
+            stage, self.current = self.current, None
+        if stage is None:
+            return
+        stats = self._stats(stage)
+        self.emit({"event": "stage_end", **stats})
+        self._display(stats, final=True)
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Reports a step that runs outside of a Pipeline (ex: copying assets) as an
+        across-file stage.  (Steps that work through many files should report each of them
+        instead, as resize_images() does.)  Example:
+
+            with progress.stage("assets"):
+                copy_directory("src/assets", "build/assets")
+
+        """
+        self.start_stage(name)
+        token = self.start_file(name)
+        try:
+            yield
+        finally:
+            self.finish_file(token)
+            self.end_stage()
+
+    def start_file(self, path, thread=True):
+        """Called when a worker starts on a file.  Returns a token for finish_file().  Pass
+        thread=False if the file is processed in another process (ex: by a ProcessPoolExecutor)
+        rather than by the calling thread, since that thread's stack says nothing about it."""
+        token = (path, threading.get_ident() if thread else None, time.monotonic())
+        with self.lock:
+            if self.current is not None:
+                self.current.in_flight[id(token)] = token
+        return token
+
+    def finish_file(self, token):
+        now = time.monotonic()
+        with self.lock:
+            stage = self.current
+            if stage is not None and stage.in_flight.pop(id(token), None) is not None:
+                stage.done += 1
+                stage.busy += now - token[2]
+                stage.last_finish = now
+                stage.stalled = None
+
+    def cache_result(self, hit):
+        """Records a cache hit (True) or miss (False) for the current stage"""
+        with self.lock:
+            if self.current is not None:
+                if hit:
+                    self.current.hits += 1
+                else:
+                    self.current.misses += 1
+
+    def _stats(self, stage):
+        now = time.monotonic()
+        with self.lock:
+            elapsed = now - stage.start
+            # include the time spent so far on files that are still in flight
+            busy = stage.busy + sum(now - token[2] for token in stage.in_flight.values())
+            done, hits, misses = stage.done, stage.hits, stage.misses
+
+        rate = done / elapsed if elapsed > 0 else 0.0
+        eta = None
+        if stage.total is not None and rate > 0:
+            eta = (stage.total - done) / rate
+        utilization = None
+        if elapsed > 0:
+            utilization = min(busy / (elapsed * stage.workers), 1.0)
+        hit_rate = hits / (hits + misses) if hits + misses > 0 else None
+        return {
+            "stage": stage.name,
+            "done": done,
+            "total": stage.total,
+            "elapsed": round(elapsed, 3),
+            "files_per_sec": round(rate, 2),
+            "eta": None if eta is None else round(eta, 1),
+            "utilization": None if utilization is None else round(utilization, 3),
+            "cache_hits": hits,
+            "cache_misses": misses,
+            "cache_hit_rate": None if hit_rate is None else round(hit_rate, 3),
+            "rss": current_rss(),
+        }
+
+    def _display(self, stats, final=False):
+        if self.stream is None:
+            return
+        parts = []
+        if stats["total"] is not None:
+            parts.append(f"{stats['done']}/{stats['total']} files")
+            parts.append(f"{stats['files_per_sec']:.1f}/s")
+            if not final:
+                parts.append(f"ETA {_format_seconds(stats['eta'])}")
+            if stats["utilization"] is not None:
+                parts.append(f"{stats['utilization']:.0%} busy")
+        if stats["cache_hit_rate"] is not None:
+            parts.append(f"{stats['cache_hit_rate']:.0%} cached")
+        parts.append(_format_seconds(stats["elapsed"]))
+        parts.append(f"RSS {_format_bytes(stats['rss'])}")
+        line = f"{stats['stage']}: " + ", ".join(parts)
+
+        with self.lock:
+            if self.tty:
+                # overwrite the current line, and keep it once the stage is done
+                self.stream.write("\r\033[K" + line + ("\n" if final else ""))
+            else:
+                self.stream.write(line + "\n")
+            self.stream.flush()
+
+    def _watch(self):
+        while not self.stopped.wait(self.interval):
+            with self.lock:
+                stage = self.current
+            if stage is None:
+                continue
+
+            stats = self._stats(stage)
+            now = time.monotonic()
+            if self.tty:
+                self._display(stats)
+            if now - self.last_log >= self.log_interval:
+                self.last_log = now
+                self.emit({"event": "progress", **stats})
+                if not self.tty:
+                    self._display(stats)
+            self._check_stall(stage, now)
+
+    def _check_stall(self, stage, now):
+        with self.lock:
+            if stage.stalled is not None or now - stage.last_finish < self.stall_timeout:
+                return
+            if not stage.in_flight:
+                return
+            path, thread_id, start = min(stage.in_flight.values(), key=lambda token: token[2])
+            stage.stalled = path
+
+        if thread_id is None:
+            stack = None
+            details = "(processed in a worker process; its stack isn't available)\n"
+        else:
+            frame = sys._current_frames().get(thread_id)
+            stack = details = "".join(traceback.format_stack(frame)) if frame is not None else ""
+        seconds = round(now - start, 1)
+        self.emit({"event": "stall", "stage": stage.name, "path": path, "seconds": seconds,
+                   "in_flight": len(stage.in_flight), "stack": stack})
+        if self.stream is not None:
+            self.stream.write(("\n" if self.tty else "")
+                              + f"WARNING: {stage.name} has made no progress for "
+                              f"{now - stage.last_finish:.0f}s; slowest file in flight is "
+                              f"'{path}' ({seconds}s):\n{details}")
+            self.stream.flush()
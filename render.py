@@ -0,0 +1,90 @@
+# File: render.py
+# Renders a single page without running a full build.  This is useful for previewing
+# changes to a page (or debugging its layout) since only that page is rendered:
+#
+#  python render.py blog.md
+#
+# prints the rendered HTML for "src/content/blog.md".  Collections are still created from
+# the front-matter of the other pages, so pages such as the blog index render as they do in
+# the full build.  The Jinja environment, metadata and collections are shared with build.py.
+#
+# The script can also run a preview server that renders pages as they are requested (and
+# serves everything else, such as assets, straight from the 'src' directory):
+#
+#  python render.py --serve 8000
+
+import sys
+import time
+import argparse
+from metalsmythe.preview import Previewer
+from build import create_jinja_env, create_metadata, create_collections, create_cache_store
+
+
+def create_previewer(prefix=""):
+    return Previewer("src/content", create_jinja_env(), create_metadata(),
+                     collections=create_collections, default_layout="simple.html",
+                     prefix=prefix, cache=create_cache_store())
+
+
+def serve_previews(previewer, port):
+    """Runs a preview server that renders content pages on each request and serves other
+    files from 'src'.  (http.server is only imported here since rendering a single page
+    doesn't need it.)"""
+    from http import HTTPStatus
+    from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+    class PreviewHTTPRequestHandler(SimpleHTTPRequestHandler):
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, directory="src", **kwargs)
+
+        def do_GET(self):
+            path = previewer.find(self.path)
+            if path is None:
+                return super().do_GET()
+
+            encoded = previewer.render(path).encode("utf-8")
+            self.send_response(HTTPStatus.OK)
+            self.send_header("Content-type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(encoded)))
+            self.send_header("Cache-Control", "no-cache")
+            self.end_headers()
+            self.wfile.write(encoded)
+
+    with ThreadingHTTPServer(("", port), PreviewHTTPRequestHandler) as httpd:
+        print(f"Serving previews on http://localhost:{port}/ ...")
+        try:
+            httpd.serve_forever()
+        except KeyboardInterrupt:
+            print("\nKeyboard interrupt received, exiting.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("path", nargs="?",
+                        help="content file to render (relative to src/content)")
+    parser.add_argument("--prefix", default="",
+                        help="Prefix for links beginning with '/'")
+    parser.add_argument("--serve", metavar="PORT", type=int,
+                        help="run a preview server on this port instead")
+    parser.add_argument("--time", action="store_true",
+                        help="print the render time to stderr")
+    args = parser.parse_args()
+
+    previewer = create_previewer(args.prefix)
+
+    if args.serve is not None:
+        serve_previews(previewer, args.serve)
+        sys.exit(0)
+
+    if args.path is None:
+        parser.error("a path is required unless --serve is given")
+
+    start = time.perf_counter()
+    try:
+        html = previewer.render(args.path)
+    except KeyError as e:
+        sys.exit(e.args[0])
+    print(html)
+    if args.time:
+        print(f"Rendered {args.path} in {(time.perf_counter() - start) * 1000:.1f} ms", file=sys.stderr)
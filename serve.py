@@ -25,6 +25,16 @@
 #  python serve.py <port> -d <directory>
 #
 # and the other parameters you would use with "python -m http.server".
+#
+# Fingerprinted assets (see metalsmythe.assets) are sent with a long-lived, immutable
+# Cache-Control header since their names change whenever their contents do.
+#
+# A site packed into a single archive (see "python build.py --pack") can be served
+# directly, without unpacking it, with:
+#
+#  python serve.py <port> --pack <file>
+#
+# The archive is memory mapped and files are sent straight from the mapping.
 
 import os
 import sys
@@ -41,6 +51,8 @@ import io
 import posixpath
 from http import HTTPStatus
 from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer, CGIHTTPRequestHandler
+from metalsmythe.assets import is_fingerprinted
+from metalsmythe.objects import PackedSite
 
 
 class CustomHTTPRequestHandler(BaseHTTPRequestHandler):
@@ -184,6 +196,8 @@ class CustomHTTPRequestHandler(BaseHTTPRequestHandler):
             self.send_header("Content-Length", str(fs[6]))
             self.send_header("Last-Modified",
                 self.date_time_string(fs.st_mtime))
+            if is_fingerprinted(path):
+                self.send_header("Cache-Control", "public, max-age=31536000, immutable")
             self.end_headers()
             return f
         except:
@@ -319,6 +333,77 @@ class CustomHTTPRequestHandler(BaseHTTPRequestHandler):
         return 'application/octet-stream'
 
 
+class PackedHTTPRequestHandler(CustomHTTPRequestHandler):
+    """Serves files from a PackedSite (see metalsmythe.objects) rather than a directory.
+    URLs are resolved the same way as CustomHTTPRequestHandler does (including the
+    ".html" and ".htm" extensions), but directories aren't listed.
+    """
+
+    def __init__(self, *args, site=None, **kwargs):
+        self.site = site
+        super().__init__(*args, directory="", **kwargs)
+
+    def do_GET(self):
+        """Serve a GET request."""
+        data = self.send_head()
+        if data is not None:
+            self.wfile.write(data)
+
+    def do_HEAD(self):
+        """Serve a HEAD request."""
+        self.send_head()
+
+    def send_head(self):
+        """Sends the response code and headers.  Returns a memoryview of the file's
+        contents, or None if there is nothing else to send."""
+        path = self.translate_path(self.path)
+        trailing_slash = path.endswith("/")
+        path = path.strip("/")
+
+        isdir = self.site.isdir(path)
+        if not trailing_slash and (isdir or not self.site.isfile(path)):
+            for ext in [".html", ".htm"]:
+                if self.site.isfile(path + ext):
+                    path = path + ext
+                    isdir = False
+                    break
+
+        if isdir:
+            parts = urllib.parse.urlsplit(self.path)
+            if not parts.path.endswith('/'):
+                self.send_response(HTTPStatus.MOVED_PERMANENTLY)
+                new_parts = (parts[0], parts[1], parts[2] + '/',
+                             parts[3], parts[4])
+                self.send_header("Location", urllib.parse.urlunsplit(new_parts))
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return None
+            for index in "index.html", "index.htm":
+                index = posixpath.join(path, index)
+                if self.site.isfile(index):
+                    path = index
+                    break
+
+        data = self.site.get(path)
+        if data is None or trailing_slash and not isdir:
+            self.send_error(HTTPStatus.NOT_FOUND, "File not found")
+            return None
+
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-type", self.guess_type(path))
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Last-Modified", self.date_time_string(self.site.mtime(path)))
+        if is_fingerprinted(path):
+            self.send_header("Cache-Control", "public, max-age=31536000, immutable")
+        self.end_headers()
+        return data
+
+    def translate_path(self, path):
+        """Translate a /-separated PATH to a path in the packed site (see
+        CustomHTTPRequestHandler.translate_path())."""
+        return super().translate_path(path).replace(os.sep, "/")
+
+
 def _get_best_family(*address):
     infos = socket.getaddrinfo(
         *address,
@@ -366,6 +451,9 @@ if __name__ == "__main__":
                         default="build",
                         help='serve this directory '
                              '(default: current directory)')
+    parser.add_argument('--pack', metavar='FILE',
+                        help='serve a packed site (see "build.py --pack") '
+                             'instead of a directory')
     parser.add_argument('-p', '--protocol', metavar='VERSION',
                         default='HTTP/1.0',
                         help='conform to this HTTP version '
@@ -374,7 +462,11 @@ if __name__ == "__main__":
                         help='bind to this port '
                              '(default: %(default)s)')
     args = parser.parse_args()
-    if args.cgi:
+    site = None
+    if args.pack:
+        site = PackedSite(args.pack)
+        handler_class = PackedHTTPRequestHandler
+    elif args.cgi:
         handler_class = CGIHTTPRequestHandler
     else:
         #handler_class = SimpleHTTPRequestHandler
@@ -392,6 +484,9 @@ if __name__ == "__main__":
             return super().server_bind()
 
         def finish_request(self, request, client_address):
+            if site is not None:
+                self.RequestHandlerClass(request, client_address, self, site=site)
+                return
             self.RequestHandlerClass(request, client_address, self,
                                      directory=args.directory)
 